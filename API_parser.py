@@ -1,32 +1,39 @@
-import requests
-import time
+import os
 from datetime import datetime, timedelta
+from http_fetcher import HttpFetcher
+from corpus import CorpusWriter
+from structured_data import save_afisha_records, save_mfc_records, format_date
+from dotenv import load_dotenv
+load_dotenv()
+
+# Адрес API; для проверки на локальном тестовом сервере см. fakes.FakeCityApi
+CITY_API_URL = os.getenv("CITY_API_URL", "https://yazzh.gate.petersburg.ru")
+AFISHA_PAGE_SIZE = int(os.getenv("AFISHA_PAGE_SIZE", "100"))
+
+HEADERS = {
+    'accept': 'application/json',
+    'region': '78'
+}
+
+# Общий пул соединений, ограничение параллельности и частоты запросов, повторы
+fetcher = HttpFetcher(CITY_API_URL, headers=HEADERS)
 
 def get_page(page_number, count=100):
     """
     Получить одну страницу данных
     """
-    url = "https://yazzh.gate.petersburg.ru/beautiful_places/"
-    
     params = {
         'page': page_number,
         'count': count
     }
     
-    headers = {
-        'accept': 'application/json',
-        'region': '78'
-    }
-    
     try:
-        response = requests.get(url, params=params, headers=headers)
-        response.raise_for_status()  
-        return response.json()
+        return fetcher.get_json("/beautiful_places/", params=params)
     except Exception as e:
         print(f"Ошибка при запросе страницы {page_number}: {e}")
         return None
 
-def get_afisha_data(page=1, count=10, days_ahead=14):
+def get_afisha_data(page=1, count=AFISHA_PAGE_SIZE, days_ahead=14):
     """
     Получить данные с афиши событий на актуальные 2 недели вперед
     """
@@ -34,8 +41,6 @@ def get_afisha_data(page=1, count=10, days_ahead=14):
     start_date = today.strftime('%Y-%m-%dT00:00:00')
     end_date = (today + timedelta(days=days_ahead)).strftime('%Y-%m-%dT00:00:00')
     
-    url = "https://yazzh.gate.petersburg.ru/afisha/all/"
-    
     params = {
         'start_date': start_date,
         'end_date': end_date,
@@ -43,23 +48,29 @@ def get_afisha_data(page=1, count=10, days_ahead=14):
         'count': count
     }
     
-    headers = {
-        'accept': 'application/json',
-        'region': '78'
-    }
-    
     try:
         print(f"Получаем афишу (страница {page}) с {start_date} по {end_date}...")
-        response = requests.get(url, params=params, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        return fetcher.get_json("/afisha/all/", params=params)
     except Exception as e:
         print(f"Ошибка при получении афиши: {e}")
         return None
 
-def get_all_afisha_events(count_per_page=10):
+def collect_pages(pages):
+    """Склеивает данные страниц по порядку до первой пустой или неполученной"""
+    items = []
+    for page, data in pages:
+        if data and data.get('data'):
+            items.extend(data['data'])
+            print(f"Страница {page}: получено {len(data['data'])} записей")
+        else:
+            print(f"Страница {page} пуста или ошибка")
+            break
+    return items
+
+def get_all_afisha_events(count_per_page=AFISHA_PAGE_SIZE):
     """
-    Получить все события афиши с учетом общего количества
+    Получить все события афиши с учетом общего количества.
+    Первая страница сообщает общее число событий, остальные загружаются параллельно
     """
     all_events = []
     
@@ -70,172 +81,127 @@ def get_all_afisha_events(count_per_page=10):
         return all_events
     
     total_count = first_page_data.get('count', 0)
-    print(f"Всего событий в афише: {total_count}")
-    
-
-    if 'data' in first_page_data:
-        all_events.extend(first_page_data['data'])
-        print(f"Получено {len(first_page_data['data'])} событий с страницы 1")
-    
-    total_pages = (total_count + count_per_page - 1) // count_per_page
+    # Сервер может отдавать меньше запрошенного count: размер страницы берём по первой странице
+    page_size = len(first_page_data.get('data') or [])
+    print(f"Всего событий в афише: {total_count}, на странице: {page_size}")
+    if not page_size:
+        return all_events
     
-    for page in range(2, total_pages + 1):
-        print(f"Получаем страницу афиши {page}...")
-        
-        page_data = get_afisha_data(page=page, count=count_per_page)
-        
-        if page_data and 'data' in page_data:
-            events_on_page = page_data['data']
-            all_events.extend(events_on_page)
-            print(f"Получено {len(events_on_page)} событий")
-        else:
-            print(f"Страница {page} пуста или ошибка")
+    total_pages = (total_count + page_size - 1) // page_size
+    pages = [(1, first_page_data)] + list(zip(
+        range(2, total_pages + 1),
+        fetcher.map(lambda page: get_afisha_data(page=page, count=count_per_page), range(2, total_pages + 1))
+    ))
+    all_events.extend(collect_pages(pages))
+    
+    # Общее число не пришло или страниц оказалось больше — дочитываем до первой пустой
+    page = max(total_pages, 1)
+    while len(all_events) >= page * page_size:
+        page += 1
+        data = get_afisha_data(page=page, count=count_per_page)
+        if not data or not data.get('data'):
             break
-        
-        time.sleep(0.3)
+        all_events.extend(data['data'])
+        print(f"Страница {page}: получено {len(data['data'])} записей")
     
     return all_events
 
-def save_afisha_to_file(events, filename="afisha_events.txt"):
+def save_afisha_to_file(events, source="afisha_events.txt"):
     """
-    Сохранить данные афиши в файл
+    Сохранить данные афиши в корпус (afisha_events.jsonl, см. corpus)
     """
     if not events:
         print("Нет данных афиши для сохранения")
         return
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        for i, event_info in enumerate(events, 1):
+    with CorpusWriter(source) as writer:
+        for event_info in events:
             place = event_info.get('place', {})
             
             categories = place.get('categories', [])
             categories_str = ', '.join(categories) if categories else 'Не указано'
             
-            start_date = place.get('start_date', 'Не указано')
-            end_date = place.get('end_date', 'Не указано')
-            
-            if start_date != 'Не указано':
-                try:
-                    start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-                    start_date_formatted = start_dt.strftime('%Y-%m-%d %H:%M')
-                except:
-                    start_date_formatted = start_date
-            
-            if end_date != 'Не указано':
-                try:
-                    end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-                    end_date_formatted = end_dt.strftime('%Y-%m-%d %H:%M')
-                except:
-                    end_date_formatted = end_date
-            
-            f.write(f"Запись {i}\n")
-            f.write(f"Название: {place.get('title', 'Не указано')}\n")
-            f.write(f"Описание: {place.get('description', 'Не указано')}\n")
-            f.write(f"Дата начала: {start_date_formatted if 'start_date_formatted' in locals() else start_date}\n")
-            f.write(f"Дата окончания: {end_date_formatted if 'end_date_formatted' in locals() else end_date}\n")
-            f.write(f"Возрастное ограничение: {place.get('age', 'Не указано')}\n")
-            f.write(f"Категория: {categories_str}\n")
-            f.write(f"Название локации: {place.get('location_title', 'Не указано')}\n")
-            f.write(f"Адрес: {place.get('address', 'Не указано')}\n")
-            f.write("-" * 50 + "\n\n")
-    
-    print(f"Данные афиши сохранены в файл {filename}")
+            writer.write({
+                'Название': place.get('title', 'Не указано'),
+                'Описание': place.get('description', 'Не указано'),
+                'Дата начала': format_date(place.get('start_date')) or 'Не указано',
+                'Дата окончания': format_date(place.get('end_date')) or 'Не указано',
+                'Возрастное ограничение': place.get('age', 'Не указано'),
+                'Категория': categories_str,
+                'Название локации': place.get('location_title', 'Не указано'),
+                'Адрес': place.get('address', 'Не указано'),
+            })
+    
+    print(f"Данные афиши сохранены в файл {writer.path}")
 
-def save_to_file(places, filename="beautiful_places.txt"):
+def save_to_file(places, source="beautiful_places.txt"):
     """
-    Сохранить данные в файл
+    Сохранить данные в корпус (beautiful_places.jsonl, см. corpus)
     """
-    with open(filename, 'w', encoding='utf-8') as f:
-        for i, place_info in enumerate(places, 1):
+    with CorpusWriter(source) as writer:
+        for place_info in places:
             place = place_info.get('place', {})
             
-            f.write(f"Запись {i}\n")
-            f.write(f"Название: {place.get('title', '')}\n")
-            f.write(f"Описание: {place.get('description', '')}\n")
-            f.write(f"Район: {place.get('district', '')}\n")
-            f.write(f"Адрес: {place.get('address', '')}\n")
-            
-            categories = place.get('categories', [])
-            categories_str = ', '.join(categories)
-            f.write(f"Категории: {categories_str}\n")
-            f.write(f"Ссылка: {place.get('data_source', '')}\n")
-            f.write("-" * 50 + "\n\n")
+            writer.write({
+                'Название': place.get('title', ''),
+                'Описание': place.get('description', ''),
+                'Район': place.get('district', ''),
+                'Адрес': place.get('address', ''),
+                'Категории': ', '.join(place.get('categories', [])),
+                'Ссылка': place.get('data_source', ''),
+            })
+    
+    print(f"Данные сохранены в файл {writer.path}")
 
 def get_all_places(start_page=1, num_pages=7, count_per_page=100):
     """
-    Получить все места с нескольких страниц
+    Получить все места с нескольких страниц (страницы загружаются параллельно)
     """
-    all_places = []
-    
-    for page in range(start_page, start_page + num_pages):
-        print(f"Получаем страницу {page}...")
-        
-        data = get_page(page, count_per_page)
-        
-        if data and 'data' in data:
-            places_on_page = data['data']
-            all_places.extend(places_on_page)
-            print(f"Получено {len(places_on_page)} мест")
-        else:
-            print(f"Страница {page} пуста или ошибка")
-            break
-        
-        time.sleep(0.3)
-    
-    return all_places
+    page_numbers = range(start_page, start_page + num_pages)
+    pages = fetcher.map(lambda page: get_page(page, count_per_page), page_numbers)
+    return collect_pages(zip(page_numbers, pages))
 
 def get_mfc_data():
     """
     Получить информацию о МФЦ
     """
-    url = "https://yazzh.gate.petersburg.ru/mfc/all/"
-    
-    headers = {
-        'accept': 'application/json',
-        'region': '78'
-    }
-    
     try:
         print("\nПолучаем информацию о МФЦ...")
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        return fetcher.get_json("/mfc/all/")
     except Exception as e:
         print(f"Ошибка при получении данных о МФЦ: {e}")
         return None
 
-def save_mfc_to_file(mfc_data, filename="mfc_info.txt"):
+def save_mfc_to_file(mfc_data, source="mfc_info.txt"):
     """
-    Сохранить информацию о МФЦ в файл
+    Сохранить информацию о МФЦ в корпус (mfc_info.jsonl, см. corpus)
     """
     if not mfc_data or 'data' not in mfc_data:
         print("Нет данных о МФЦ для сохранения")
         return
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        for i, mfc in enumerate(mfc_data['data'], 1):
-            f.write(f"Запись {i}\n")
-            f.write(f"Название: {mfc.get('name', '')}\n")
-            f.write(f"Адрес: {mfc.get('address', '')}\n")
-            f.write(f"Время работы: {mfc.get('working_hours', '')}\n")
-            
+    with CorpusWriter(source) as writer:
+        for mfc in mfc_data['data']:
             accessible_env = mfc.get('accessible_env', [])
-            accessible_str = ', '.join(accessible_env) if accessible_env else 'Нет информации'
-            f.write(f"Доступность: {accessible_str}\n")
-            
-            link = mfc.get('link', '')
-            f.write(f"Ссылка: {link}\n")
+            fields = {
+                'Название': mfc.get('name', ''),
+                'Адрес': mfc.get('address', ''),
+                'Время работы': mfc.get('working_hours', ''),
+                'Доступность': ', '.join(accessible_env) if accessible_env else 'Нет информации',
+                'Ссылка': mfc.get('link', ''),
+            }
             
             nearest_metro = mfc.get('nearest_metro', '')
             if nearest_metro:
-                f.write(f"Ближайшее метро: {nearest_metro}\n")
+                fields['Ближайшее метро'] = nearest_metro
             
             phone = mfc.get('phone', [])
             if phone:
-                phone_str = ', '.join(phone)
-                f.write(f"Телефон: {phone_str}\n")
+                fields['Телефон'] = ', '.join(phone)
             
-            f.write("-" * 50 + "\n\n")
+            writer.write(fields)
+    
+    print(f"Данные о МФЦ сохранены в файл {writer.path}")
 
 def main():
     """
@@ -247,21 +213,20 @@ def main():
     all_places = get_all_places(start_page=1, num_pages=7, count_per_page=100)
     
     if all_places:
-        save_to_file(all_places, "beautiful_places.txt")
+        save_to_file(all_places)
         print(f"\nВсего получено {len(all_places)} красивых мест")
-        print("Данные сохранены в файл beautiful_places.txt")
     else:
         print("Не удалось получить данные о красивых местах")
     
     print("\n" + "=" * 50)
     print("Получение данных с афиши событий...")
     print("=" * 50)
-    afisha_events = get_all_afisha_events(count_per_page=10)
+    afisha_events = get_all_afisha_events()
     
     if afisha_events:
-        save_afisha_to_file(afisha_events, "afisha_events.txt")
+        save_afisha_to_file(afisha_events)
+        save_afisha_records(afisha_events)
         print(f"\nВсего получено {len(afisha_events)} событий из афиши")
-        print("Данные афиши сохранены в файл afisha_events.txt")
     else:
         print("Не удалось получить данные афиши")
     
@@ -271,11 +236,14 @@ def main():
     mfc_data = get_mfc_data()
     
     if mfc_data:
-        save_mfc_to_file(mfc_data, "mfc_info.txt")
+        save_mfc_to_file(mfc_data)
+        save_mfc_records(mfc_data.get('data', []))
         print(f"Получено {len(mfc_data['data'])} МФЦ")
-        print("Данные о МФЦ сохранены в файл mfc_info.txt")
     else:
         print("Не удалось получить данные о МФЦ")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        fetcher.close()
\ No newline at end of file
@@ -1,130 +1,191 @@
 import os
-from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-import re
+import json
+import time
+from contextvars import ContextVar, copy_context
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import Annotated, Sequence, TypedDict
-from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage, message_chunk_to_message
 from langchain_gigachat import GigaChat, GigaChatEmbeddings
 from langchain_core.tools import tool
 from operator import add as add_messages
 from langgraph.graph import StateGraph, END
-from langchain_chroma import Chroma
+from knowledge_base import open_vectorstore, index_version, active_filter, is_active, compact_expired, PERSIST_DIR
+from lexical_index import open_lexical_index, query_terms, reciprocal_rank_fusion
+from vector_index import open_mmap_index, mmr_search_batch
+from embedding_cache import CachedEmbeddings
+from answer_cache import SemanticCache, ANSWER_CACHE_AFISHA_TTL
+from metrics import timed, trace_add, inc, record_llm_usage, register_gauges
+from history_compaction import compact_history, estimate_tokens, LLM_TOKEN_BUDGET
+from context_assembly import assemble_context, context_artifact, seen_chunk_ids
+from structured_data import ensure_structured_db, find_mfc, find_events, format_mfc, format_events, purge_past_events
 from toxicity_test import check_toxicity
+from query_router import QueryRouter, ROUTER_ENABLED, ROUTE_ANSWER, ROUTE_RETRIEVAL, ROUTE_LLM
 from dotenv import load_dotenv
 load_dotenv()
 
 GIGACHAT_KEY = os.getenv("GIGACHAT_API_KEY")
 GIGACHAT_EMBEDD_KEY = os.getenv("GIGACHAT_EMBEDDINGS_KEY")
+# gigachat — рабочий режим, fake — локальные заменители без сети (см. fakes.py, benchmark.py)
+AGENT_BACKEND = os.getenv("AGENT_BACKEND", "gigachat")
 
-model = GigaChat(
-    credentials=GIGACHAT_KEY,
-    verify_ssl_certs=False,
-    temperature=0
-)
-model.model = "GigaChat-2"
-
-embeddings = GigaChatEmbeddings(
-    credentials=GIGACHAT_EMBEDD_KEY,
-    verify_ssl_certs=False
-)
-
-file_list = ["all_parsed_data.txt", "afisha_events.txt", "beautiful_places.txt", "mfc_info.txt"] 
-combined_content = ""
-
-for file_name in file_list:
-    try:
-        with open(file_name, "r", encoding="utf-8") as f:
-            combined_content += f.read() + "\n" 
-    except Exception as e:
-        print(f"Ошибка при чтении файла {file_name} - {e}")
-        raise
-
-raw_entries = re.split(r"\s*Запись\s*\d+\s*", combined_content)
-entries = [e.strip() for e in raw_entries if e.strip()]
-
-docs = []
+if AGENT_BACKEND == "fake":
+    from fakes import FakeChatModel, FakeEmbeddings
+    model = FakeChatModel(latency=float(os.getenv("FAKE_LLM_LATENCY", "0.5")))
+    base_embeddings = FakeEmbeddings(size=256, latency=float(os.getenv("FAKE_EMBED_LATENCY", "0.05")))
+else:
+    model = GigaChat(
+        credentials=GIGACHAT_KEY,
+        verify_ssl_certs=False,
+        temperature=0
+    )
+    model.model = "GigaChat-2"
 
-for idx, entry in enumerate(entries, start=1):
-    docs.append(
-        Document(
-            page_content=entry,
-            metadata={"entry_id": idx}
-        )
+    base_embeddings = GigaChatEmbeddings(
+        credentials=GIGACHAT_EMBEDD_KEY,
+        verify_ssl_certs=False
     )
 
-splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=250
-)
+# Общий для агента и бота кэш эмбеддингов запросов (см. embedding_cache)
+embeddings = CachedEmbeddings(base_embeddings)
 
-final_docs = []
+vectorstore = open_vectorstore(embeddings)
+INDEX_VERSION = index_version()
+AFISHA_SOURCE = "afisha_events.txt"
 
-for doc in docs:
-    text = doc.page_content
-    chunks = splitter.split_text(text)
-    for i, chunk in enumerate(chunks):
-        final_docs.append(
-            Document(
-                page_content=chunk,
-                metadata={
-                    "entry_id": doc.metadata["entry_id"],
-                    "chunk": i
-                }
-            )
-        )
+answer_cache = SemanticCache()
+register_gauges("answer_cache", answer_cache.metrics)
+register_gauges("embedding_cache", embeddings.metrics)
 
- 
-PERSIST_DIR = "data/chroma_db"
+router = QueryRouter(embeddings, PERSIST_DIR)
+if ROUTER_ENABLED:
+    try:
+        router.load()
+    except Exception as e:
+        # Векторы категорий будут посчитаны при первом вопросе
+        print(f"Ошибка загрузки категорий маршрутизатора: {e}")
 
+RETRIEVER_K = 8
+# chroma — поиск через Chroma, mmap — по выгруженной из неё матрице векторов в общей
+# памяти процессов (см. vector_index), для нескольких воркеров webhook.py
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+search_store = open_mmap_index(vectorstore, PERSIST_DIR, INDEX_VERSION) if VECTOR_BACKEND == "mmap" else vectorstore
 
+def vector_search_batch(queries: list):
+    """
+    MMR-поиск только среди ещё не закончившихся событий и записей без дат, сразу для
+    нескольких запросов: один запрос эмбеддингов и один поиск по базе (см. vector_index)
+    """
+    if not queries:
+        return []
+    vectors = embeddings.embed_queries(queries)
+    return mmr_search_batch(search_store, vectors, k=RETRIEVER_K, fetch_k=20, lambda_mult=0.8,
+                            filter=active_filter())
+
+# Гибридный поиск: BM25 по тем же фрагментам + векторный MMR, результаты объединяются RRF
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+LEXICAL_MIN_HITS = int(os.getenv("LEXICAL_MIN_HITS", "1"))
+lexical_index = open_lexical_index(vectorstore, PERSIST_DIR, INDEX_VERSION) if HYBRID_SEARCH else None
+
+def lexical_search(query: str):
+    """
+    Поиск по словам. Возвращает найденные документы (сначала содержащие все слова
+    запроса) и признак того, что их достаточно без векторного поиска: в запросе есть
+    редкое слово (название, станция метро), и не меньше LEXICAL_MIN_HITS фрагментов
+    содержат все слова запроса
+    """
+    now = time.time()
+    hits = [hit for hit in lexical_index.search(query, k=20) if is_active(lexical_index.metadatas[hit[0]], now)]
+    n_terms = len(query_terms(query))
+    full = [lexical_index.document(i) for i, _, matched in hits if matched == n_terms]
+    partial = [lexical_index.document(i) for i, _, matched in hits if matched != n_terms]
+    confident = n_terms > 0 and len(full) >= LEXICAL_MIN_HITS and lexical_index.has_rare_term(query)
+    return full + partial, confident
+
+@timed("retrieval")
+def search_documents_batch(queries: list):
+    """
+    Ищет фрагменты для нескольких запросов: по словам (BM25) и в векторной базе (MMR).
+    Векторный поиск выполняется одним пакетом для всех запросов, которым он нужен
+    """
+    results = [None] * len(queries)
+    lexical_results = {}
+    for i, query in enumerate(queries):
+        if lexical_index is None:
+            continue
+        lexical_docs, confident = timed("lexical_search")(lexical_search)(query)
+        if confident:
+            # Точное совпадение по редким словам — эмбеддинг запроса не нужен
+            trace_add("lexical_only_searches")
+            results[i] = lexical_docs[:RETRIEVER_K]
+        else:
+            lexical_results[i] = lexical_docs
 
-if os.path.exists(PERSIST_DIR):
-    print("Найдена существующая база Chroma")
-    vectorstore = Chroma(
-        persist_directory=PERSIST_DIR,
-        embedding_function=embeddings
-    )
-    print("База загружена")
-else:
-    print("База не найдена — создание...")
-    vectorstore = Chroma.from_documents(
-        documents=final_docs,
-        embedding=embeddings,
-        persist_directory=PERSIST_DIR
-    )
-    print("База создана")
+    pending = [i for i, docs in enumerate(results) if docs is None]
+    for i, docs in zip(pending, vector_search_batch([queries[i] for i in pending])):
+        results[i] = docs if lexical_index is None else reciprocal_rank_fusion([docs, lexical_results[i]], RETRIEVER_K)
+    trace_add("retrieved_chunks", sum(len(docs) for docs in results))
+    return results
 
-retriever = vectorstore.as_retriever(
-    search_type="mmr",
-    search_kwargs={"k": 8, "fetch_k": 20, "lambda_mult": 0.8}
-)
+def search_documents(query: str):
+    return search_documents_batch([query])[0]
 
-@tool
-def retriever_tool(query: str) -> str:
+@tool(response_format="content_and_artifact")
+def retriever_tool(query: str):
     """
     Этот инструмент ищет и возвращает релевантную информацию в базе данных 
     """
 
-    docs = retriever.invoke(query)
+    content, used = assemble_context(search_documents(query))
+    return content, context_artifact(used)
 
-    if not docs:
-        return "Релевантной информации в документе не найдено"
-    
-    results = []
-    for i, doc in enumerate(docs):
-        results.append(f"Фрагмент {i+1}:\n{doc.page_content}")
+# Структурированные данные о МФЦ и афише (SQLite с индексами, см. structured_data)
+MFC_SOURCE = "mfc_info.txt"
+ensure_structured_db()
+
+@tool(response_format="content_and_artifact")
+def mfc_lookup_tool(metro: str = "", district: str = "", address: str = "", day: str = ""):
+    """
+    Находит МФЦ Санкт-Петербурга по условиям: станция метро (metro), район (district),
+    часть адреса (address), день недели или дата YYYY-MM-DD, когда МФЦ должен работать (day).
+    Возвращает названия, адреса, время работы, метро и телефоны. Пустые условия не учитываются
+    """
+    rows = timed("structured_lookup")(find_mfc)(metro, district, address, day)
+    content = format_mfc(rows) if rows else "МФЦ по заданным условиям не найдены"
+    return content, {"sources": [MFC_SOURCE], "chunk_ids": []}
+
+@tool(response_format="content_and_artifact")
+def afisha_lookup_tool(date_from: str = "", date_to: str = "", category: str = "", title: str = ""):
+    """
+    Находит события городской афиши, которые идут в промежутке дат date_from - date_to
+    (формат YYYY-MM-DD, по умолчанию сегодня), по категории (category: театр, концерт,
+    выставка и т.п.) и словам из названия (title)
+    """
+    rows = timed("structured_lookup")(find_events)(date_from, date_to, category, title)
+    content = format_events(rows) if rows else "Событий по заданным условиям не найдено"
+    return content, {"sources": [AFISHA_SOURCE], "chunk_ids": []}
 
-    return "\n\n".join(results)
+tools = [retriever_tool, mfc_lookup_tool, afisha_lookup_tool]
 
-tools = [retriever_tool]
+def compact_expired_events():
+    """Удаляет закончившиеся события из векторной и структурированной баз (вызывается по расписанию)"""
+    removed = compact_expired(vectorstore)
+    removed_chunks = sum(removed.values())
+    removed_events = purge_past_events()
+    inc("expired_chunks_removed_total", removed_chunks)
+    print(f"Удалено устаревших фрагментов: {removed_chunks}, событий афиши: {removed_events}")
+    return removed_chunks
 
 model = model.bind_tools(tools)
 
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
+    query_embedding: list
+    route: str
 
+@timed("start_node")
 def start_node(state: AgentState):
-    return state
+    # Возврат всего state продублировал бы сообщения через reducer add_messages
+    return {"messages": []}
 
 def should_continue(state: AgentState):
     """Проверяет, содержит ли последнее сообщение вызов инструмента"""
@@ -132,21 +193,109 @@ def should_continue(state: AgentState):
     return hasattr(result, "tool_calls") and len(result.tool_calls) > 0
 
 
+@timed("toxicity")
 def check_toxic(state: AgentState):
     """Использует функцию check_toxicity для определения токсичности сообщения"""
     message = state["messages"][-1].content
     if (float(check_toxicity(message)["toxic"]) < 0.6):
         return True
     else:
-        print("Вы слишком грубы! К сожалению, я не смогу Вам помочь.")
+        inc("toxic_messages_total")
+        trace_add("toxic_messages")
         return False
 
+def is_single_turn(state: AgentState):
+    """Кэшируются только ответы на первый вопрос диалога — без учёта контекста"""
+    return sum(1 for msg in state["messages"] if msg.type == "human") == 1
+
+
+@timed("router")
+def route_query(state: AgentState):
+    """
+    Маршрут вопроса до вызова LLM (см. query_router): готовый ответ, сразу поиск
+    по базе знаний или, как раньше, выбор инструмента моделью
+    """
+    if not ROUTER_ENABLED:
+        return {"messages": [], "route": ROUTE_LLM}
+
+    text = state["messages"][-1].content
+    try:
+        route, answer = router.route(text, embeddings.embed_query, first_turn=is_single_turn(state))
+    except Exception as e:
+        print(f"Ошибка маршрутизации: {e}")
+        route, answer = ROUTE_LLM, None
+    inc("router_decisions_total", route=route)
+    trace_add(f"route_{route}")
+
+    if answer is not None:
+        return {"messages": [AIMessage(content=answer)], "route": route}
+    return {"messages": [], "route": route}
+
+
+def is_answered(state: AgentState):
+    return state.get("route") == ROUTE_ANSWER
+
+
+@timed("cache_lookup")
+def cache_lookup(state: AgentState):
+    """Ищет готовый ответ на похожий вопрос в кэше ответов"""
+    if not is_single_turn(state):
+        return {"messages": []}
+
+    vector = embeddings.embed_query(state["messages"][-1].content)
+    answer = answer_cache.lookup(vector, INDEX_VERSION)
+    trace_add("answer_cache_hits" if answer is not None else "answer_cache_misses")
+
+    if answer is None:
+        return {"messages": [], "query_embedding": vector}
+    return {"messages": [AIMessage(content=answer)], "query_embedding": vector}
+
+
+def after_cache(state: AgentState):
+    """Готовый ответ из кэша, иначе LLM или сразу поиск по базе знаний"""
+    if state["messages"][-1].type == "ai":
+        return END
+    return "direct_retrieval" if state.get("route") == ROUTE_RETRIEVAL else "llm"
+
+
+def direct_retrieval(state: AgentState):
+    """Вызов retriever_tool с текстом вопроса вместо первого вызова LLM"""
+    query = state["messages"][-1].content
+    call = {"name": "retriever_tool", "args": {"query": query},
+            "id": f"router_{len(state['messages'])}", "type": "tool_call"}
+    return {"messages": [AIMessage(content="", tool_calls=[call])]}
+
+
+@timed("cache_store")
+def cache_store(state: AgentState):
+    """
+    Сохраняет итоговый ответ в кэш; ответы по афише живут меньше. Ответ, построенный
+    после ошибки или таймаута инструмента, не кэшируется
+    """
+    vector = state.get("query_embedding")
+    answer = state["messages"][-1].content
+    if vector is None or not answer or not is_single_turn(state):
+        return {"messages": []}
+
+    artifacts = [
+        msg.artifact for msg in state["messages"] if isinstance(msg, ToolMessage) and isinstance(msg.artifact, dict)
+    ]
+    if any(artifact.get("error") for artifact in artifacts):
+        trace_add("answer_cache_skipped_errors")
+        return {"messages": []}
+    from_afisha = any(AFISHA_SOURCE in artifact.get("sources", []) for artifact in artifacts)
+    ttl = ANSWER_CACHE_AFISHA_TTL if from_afisha else None
+    answer_cache.store(vector, answer, INDEX_VERSION, ttl=ttl)
+    return {"messages": []}
+
 system_prompt = """
 Ты интеллектуальный агент, который отвечает на вопросы о государственных сервисах и услугах Санкт-Петербурга в 2025 году, базируясь на доступной тебе векторной базе данных.
 Отвечай только на вопросы, связанные с Санкт-Петерубургом и его государственными сервисами и услугами. Если тема вопроса другая, сообщи, что ты агент-помощнник в сфере государственных услуг и жизни в Санкт-Петербурге и не отвечай на вопрос.
 Если вопрос о красивых местах в Санкт-Петербурге, то старайся отвечать не только про места, расположенные в Карелии, но и про другие.
 Если вопрос о каких-либо мероприятиях в городе, обязательно добавляй в ответ название этого события.
 Используй инструмент retriever_tool для ответа на вопросы о государственных услугах, документах, жизненных ситуациях.
+Для поиска МФЦ по станции метро, району, адресу или дню работы используй инструмент mfc_lookup_tool.
+Для поиска мероприятий за конкретные даты или по категории используй инструмент afisha_lookup_tool, даты передавай в формате YYYY-MM-DD. Сегодня {today}.
 Если тебе нужно найти какую-то информацию, прежде чем задать уточняющий вопрос, ты можешь это сделать, но не более 3 уточнений по одному вопросу, это очень важно. Если после 3 вызовов retriever_tool по одному вопросу ты считаешь ответ недостаточным, то отвечай, что ты не можешь ответить на вопрос.
 При ответе на вопрос всегда анализируй все фрагменты, которые предоставляет тебе retriever_tool. Формируй ответ из всех них, чтобы он получился более полным.
 Если найденный фрагмент содержит возрастные, социальные или иные ограничения,но в запросе пользователя таких ограничений нет — ищи дальше. Не возвращай такие документы как основной ответ.
@@ -157,31 +306,118 @@ system_prompt = """
 
 tool_dict = {our_tool.name: our_tool for our_tool in tools}
 
+# Получатель текста ответа по мере генерации (см. bot.StreamingReply): функция, которой
+# передаётся весь накопленный текст текущего вызова LLM. None — без потоковой генерации
+answer_stream = ContextVar("answer_stream", default=None)
+
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "20"))  # секунд на все вызовы одного шага
+tool_executor = ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_WORKERS", "8")), thread_name_prefix="tool")
+
+def visible_history(messages):
+    """История в том виде, в каком её увидит LLM (см. history_compaction)"""
+    return compact_history(messages, max_tokens=LLM_TOKEN_BUDGET - estimate_tokens(system_prompt))
+
+@timed("llm")
 def call_llm(state: AgentState):
-    messages = list(state["messages"])
-    print(messages)
-    messages = [SystemMessage(content=system_prompt)] + messages
-    message = model.invoke(messages)
+    messages, tokens_saved = visible_history(state["messages"])
+    inc("history_tokens_saved_total", tokens_saved)
+    trace_add("history_tokens_saved", tokens_saved)
+    prompt = system_prompt.replace("{today}", time.strftime("%Y-%m-%d"))
+    messages = [SystemMessage(content=prompt)] + messages
+    on_text = answer_stream.get()
+    message = model.invoke(messages) if on_text is None else stream_llm(messages, on_text)
+    record_llm_usage(message)
     return {"messages": [message]}
 
+def stream_llm(messages, on_text):
+    """Вызов модели в потоковом режиме: накопленный текст ответа передаётся в on_text после каждого фрагмента"""
+    message = None
+    for chunk in model.stream(messages):
+        message = chunk if message is None else message + chunk
+        if chunk.content:
+            on_text(str(message.content))
+    return message_chunk_to_message(message)
+
+# Инструменты поиска документов: их результаты собираются в контекст в take_action,
+# чтобы не повторять фрагменты, уже показанные модели в этом диалоге. Все вызовы такого
+# инструмента за один шаг выполняются одним пакетом (функция получает список запросов)
+document_search = {"retriever_tool": search_documents_batch}
+
+def run_tool(name: str, args: dict):
+    """Текст ответа и artifact инструмента (поиск документов — см. take_action)"""
+    message = tool_dict[name].invoke(
+        {"type": "tool_call", "id": name, "name": name, "args": args}
+    )
+    return message.content, message.artifact
+
+def call_key(tool_call):
+    """Одинаковые вызовы одного шага (имя и аргументы) выполняются один раз"""
+    return tool_call['name'], json.dumps(tool_call['args'], sort_keys=True, ensure_ascii=False)
+
+@timed("retriever_agent")
 def take_action(state: AgentState) -> AgentState:
-    """Выполняет вызовы инструментов по запросу llm (model)"""
+    """
+    Выполняет вызовы инструментов по запросу llm (model). Вызовы одного шага
+    выполняются параллельно, поиски документов — одним пакетом, одинаковые запросы —
+    один раз, порядок ответов сохраняется
+    """
     tool_calls = state["messages"][-1].tool_calls
+    futures = {}  # call_key -> (future, номер запроса в пакете или None)
+    batches = {}  # инструмент поиска документов -> {call_key: запрос}
+    for t in tool_calls:
+        inc("tool_calls_total", tool=t['name'])
+        trace_add("tool_calls")
+        if t['name'] not in tool_dict or call_key(t) in futures:
+            continue
+        if t['name'] in document_search:
+            batches.setdefault(t['name'], {})[call_key(t)] = t['args'].get('query', '')
+            futures[call_key(t)] = None
+        else:
+            # copy_context — чтобы метрики инструмента попали в трассу текущего запроса
+            futures[call_key(t)] = (tool_executor.submit(copy_context().run, run_tool, t['name'], t['args']), None)
+    for name, calls in batches.items():
+        future = tool_executor.submit(copy_context().run, document_search[name], list(calls.values()))
+        for i, key in enumerate(calls):
+            futures[key] = (future, i)
+
+    # Повторно не отдаём только то, что модель ещё видит после сжатия истории
+    seen = seen_chunk_ids(visible_history(state["messages"])[0])
+    deadline = time.monotonic() + TOOL_TIMEOUT
     results = []
     for t in tool_calls:
-        print(f"Вызываемый инструмент: {t['name']} с запросом: {t['args'].get('query', 'No query provided')}")
+        artifact = None
 
         if not t['name'] in tool_dict:
             print(f"\nTool: {t['name']} не сушествует")
-            result = "Некорректное имя инструмента"
-        
-        else:
-            result = tool_dict[t['name']].invoke(t['args'].get('query', ''))
-            print(f"Итоговая длина: {len(str(result))}")
+            content = "Некорректное имя инструмента"
+            artifact = {"error": True}
 
-        results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result)))
+        else:
+            future, index = futures[call_key(t)]
+            try:
+                result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                if index is not None:
+                    result = result[index]
+                if t['name'] in document_search:
+                    content, used = assemble_context(result, seen)
+                    seen.update(doc.id for doc in used)
+                    artifact = context_artifact(used)
+                    raw_tokens = sum(estimate_tokens(doc.page_content) for doc in result)
+                    trace_add("context_tokens_saved", max(0, raw_tokens - estimate_tokens(content)))
+                else:
+                    content, artifact = result
+                trace_add("tool_result_chars", len(str(content)))
+            except FutureTimeoutError:
+                print(f"Tool: {t['name']} не ответил за {TOOL_TIMEOUT} секунд")
+                content = "Поиск не успел завершиться. Ответь по уже найденной информации или уточни запрос"
+                artifact = {"error": True}
+            except Exception as e:
+                print(f"Ошибка инструмента {t['name']}: {e}")
+                content = "Ошибка при поиске информации"
+                artifact = {"error": True}
+
+        results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(content), artifact=artifact))
 
-    print("Выполнение инструментов завершено")
     return {'messages': results}
 
 
@@ -192,16 +428,32 @@ graph.add_node("start_node", start_node)
 graph.add_conditional_edges(
     "start_node", 
     check_toxic,
-    {True: "llm", False: END}
+    {True: "router", False: END}
+)
+graph.add_node("router", route_query)
+graph.add_conditional_edges(
+    "router",
+    is_answered,
+    {True: END, False: "cache_lookup"}
+)
+graph.add_node("cache_lookup", cache_lookup)
+graph.add_conditional_edges(
+    "cache_lookup",
+    after_cache,
+    {END: END, "llm": "llm", "direct_retrieval": "direct_retrieval"}
 )
+graph.add_node("direct_retrieval", direct_retrieval)
+graph.add_edge("direct_retrieval", "retriever_agent")
 graph.add_node("llm", call_llm)
 graph.add_node("retriever_agent", take_action)
+graph.add_node("cache_store", cache_store)
 
 graph.add_conditional_edges(
     "llm",
     should_continue,
-    {True: "retriever_agent", False: END}
+    {True: "retriever_agent", False: "cache_store"}
 )
+graph.add_edge("cache_store", END)
 
 graph.add_edge("retriever_agent", "llm")
 graph.set_entry_point("start_node")
@@ -0,0 +1,69 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "8"))
+AGENT_MAX_PENDING = int(os.getenv("AGENT_MAX_PENDING", "64"))
+AGENT_MAX_PENDING_PER_USER = int(os.getenv("AGENT_MAX_PENDING_PER_USER", "3"))
+
+
+class PoolOverloaded(Exception):
+    """Очередь запросов к агенту переполнена"""
+
+
+class AgentPool:
+    """
+    Выполняет синхронные вызовы агента в пуле потоков, не блокируя event loop.
+    Одновременно выполняется не более max_workers запросов, запросы одного
+    пользователя выполняются строго по очереди, а при переполнении очереди
+    новые запросы отклоняются.
+    """
+
+    def __init__(self, max_workers=AGENT_WORKERS, max_pending=AGENT_MAX_PENDING,
+                 max_pending_per_user=AGENT_MAX_PENDING_PER_USER):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent")
+        self.semaphore = asyncio.Semaphore(max_workers)
+        self.pending = 0
+        self.user_queues = {}  # user_id -> [asyncio.Lock, число ожидающих запросов]
+
+    def has_capacity(self, user_id) -> bool:
+        """Проверяет, можно ли поставить в очередь ещё один запрос пользователя"""
+        if self.pending >= self.max_pending:
+            return False
+        user_queue = self.user_queues.get(user_id)
+        return user_queue is None or user_queue[1] < self.max_pending_per_user
+
+    async def run(self, user_id, func, *args, ready=None, **kwargs):
+        """
+        Выполняет func(*args, **kwargs) в пуле с учётом очереди пользователя.
+        ready — asyncio.Event (например, окончание загрузки агента), которого запрос
+        ждёт, уже заняв место в очереди: ожидающие тоже ограничены max_pending
+        """
+        if not self.has_capacity(user_id):
+            raise PoolOverloaded(f"Очередь переполнена (ожидает {self.pending} запросов)")
+
+        user_queue = self.user_queues.setdefault(user_id, [asyncio.Lock(), 0])
+        user_queue[1] += 1
+        self.pending += 1
+        try:
+            if ready is not None:
+                await ready.wait()
+            async with user_queue[0]:
+                async with self.semaphore:
+                    loop = asyncio.get_running_loop()
+                    call = functools.partial(func, *args, **kwargs)
+                    return await loop.run_in_executor(self.executor, call)
+        finally:
+            self.pending -= 1
+            user_queue[1] -= 1
+            if user_queue[1] == 0:
+                self.user_queues.pop(user_id, None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,83 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+ANSWER_CACHE_AFISHA_TTL = float(os.getenv("ANSWER_CACHE_AFISHA_TTL", str(3600)))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+
+class SemanticCache:
+    """
+    Кэш готовых ответов по смыслу вопроса: ответ выдаётся, если косинусная близость
+    эмбеддинга нового вопроса к сохранённому не ниже threshold и версия индекса та же.
+    Записи живут ttl секунд, при переполнении вытесняются давно не использованные.
+    """
+
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                 threshold=ANSWER_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.entries = OrderedDict()  # key -> (вектор, ответ, версия индекса, срок жизни)
+        self.next_key = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "expired": 0, "evicted": 0}
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _purge_expired(self, now):
+        expired = [key for key, entry in self.entries.items() if entry[3] <= now]
+        for key in expired:
+            del self.entries[key]
+        self.stats["expired"] += len(expired)
+
+    def lookup(self, vector, version):
+        """Возвращает сохранённый ответ на похожий вопрос или None"""
+        query = self._normalize(vector)
+        with self.lock:
+            self._purge_expired(time.time())
+            keys = [key for key, entry in self.entries.items() if entry[2] == version]
+            if keys:
+                matrix = np.stack([self.entries[key][0] for key in keys])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = keys[best]
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return self.entries[key][1]
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, vector, answer, version, ttl=None):
+        with self.lock:
+            expires = time.time() + (self.ttl if ttl is None else ttl)
+            self.entries[self.next_key] = (self._normalize(vector), answer, version, expires)
+            self.next_key += 1
+            self.stats["stored"] += 1
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def metrics(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "size": len(self.entries),
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            }
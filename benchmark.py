@@ -0,0 +1,208 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+from fakes import FakeBot, FakeMessage
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Офлайн-замер производительности бота: GigaChat, эмбеддинги и Telegram заменены на fakes.py"
+    )
+    parser.add_argument("--levels", default="1,4,16", help="уровни параллельности (число одновременных пользователей)")
+    parser.add_argument("--turns", type=int, default=3, help="сообщений от каждого пользователя")
+    parser.add_argument("--queries", help="файл с запросами, по одному в строке (по умолчанию — из файлов данных)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="задержка одного вызова LLM, секунд")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="задержка одного запроса эмбеддинга, секунд")
+    parser.add_argument("--real-toxicity", action="store_true", help="использовать настоящую модель токсичности")
+    parser.add_argument("--keep-caches", action="store_true", help="не очищать кэши между уровнями")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--retrieval-eval", type=int, default=0, metavar="N",
+                        help="вместо замера бота — оценка поиска на N вопросах: по одному и пакетами")
+    parser.add_argument("--eval-batch", type=int, default=64, help="вопросов в одном пакете при оценке поиска")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """Переключает агента на локальные заменители; задаётся до импорта bot и agent"""
+    os.environ["AGENT_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+    os.environ["FAKE_EMBED_LATENCY"] = str(args.embed_latency)
+    if not args.real_toxicity:
+        os.environ["TOXICITY_BACKEND"] = "fake"
+    os.environ.setdefault("CHROMA_PERSIST_DIR", "data/bench_chroma_db")
+    os.environ.setdefault("STRUCTURED_DB", "data/bench_city_data.sqlite3")
+    os.environ.setdefault("EMBED_RATE_LIMIT", "0")
+    os.environ.setdefault("METRICS_LOG", "0")
+    os.environ.setdefault("SESSION_DB", "")
+    os.environ["TELEGRAM_BOT_TOKEN"] = "123456:offline-benchmark"
+
+
+def load_queries(path, seed):
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+
+    queries = [
+        "Привет!",
+        "Где ближайший МФЦ?",
+        "Как получить паспорт?",
+        "Какие мероприятия будут на выходных?",
+        "Спасибо!",
+    ]
+    titles = []
+    for file_name in ["all_parsed_data.txt", "afisha_events.txt", "beautiful_places.txt", "mfc_info.txt"]:
+        with open(file_name, "r", encoding="utf-8") as f:
+            titles += re.findall(r"^Название: (.+)$", f.read(), flags=re.MULTILINE)[:100]
+    rng = random.Random(seed)
+    for title in rng.sample(titles, min(len(titles), 200)):
+        queries.append(rng.choice(["Расскажи про {}", "Где найти информацию: {}?", "{} — что это?"]).format(title))
+    rng.shuffle(queries)
+    return queries
+
+
+def load_eval_questions(count, seed):
+    """Вопросы для оценки поиска: (вопрос по названию записи, название, которое должно найтись)"""
+    titles = []
+    for file_name in ["all_parsed_data.txt", "afisha_events.txt", "beautiful_places.txt", "mfc_info.txt"]:
+        with open(file_name, "r", encoding="utf-8") as f:
+            titles += re.findall(r"^Название: (.+)$", f.read(), flags=re.MULTILINE)
+    rng = random.Random(seed)
+    return [
+        (rng.choice(["Расскажи про {}", "Где найти информацию: {}?", "{} — что это?"]).format(title), title[:200])
+        for title in rng.sample(titles, min(len(titles), count))
+    ]
+
+
+def evaluate_retrieval(agent, questions, batch_size):
+    """Время и доля вопросов, для которых среди найденных фрагментов есть нужная запись (hit@k)"""
+    results = []
+    for mode in ("по одному", "пакетами"):
+        agent.embeddings.clear()
+        calls_before = agent.base_embeddings.calls
+        start = time.perf_counter()
+        if mode == "по одному":
+            found = [agent.search_documents(query) for query, _ in questions]
+        else:
+            found = []
+            for i in range(0, len(questions), batch_size):
+                found += agent.search_documents_batch([query for query, _ in questions[i:i + batch_size]])
+        elapsed = time.perf_counter() - start
+        hits = sum(any(doc.metadata.get("title") == title for doc in docs) for docs, (_, title) in zip(found, questions))
+        results.append({
+            "mode": mode,
+            "questions": len(questions),
+            "seconds": round(elapsed, 3),
+            "embedding_requests": agent.base_embeddings.calls - calls_before,
+            f"hit_at_{agent.RETRIEVER_K}": round(hits / max(1, len(questions)), 3),
+        })
+    return results
+
+
+def rss_mb():
+    """Текущий RSS процесса (на Linux), иначе пиковый"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_level(bot_module, fake_bot, queries, concurrency, turns, level):
+    latencies = []
+    first_visible = []  # когда пользователь увидел начало ответа (первое изменение «Думаю...»)
+    errors = []
+
+    async def user(user_id):
+        for turn in range(turns):
+            query = queries[(user_id * turns + turn) % len(queries)]
+            message = FakeMessage(fake_bot, level * 100000 + user_id, query)
+            sent_before = len(fake_bot.sent)
+            start = time.perf_counter()
+            await bot_module.handle_message(message)
+            latencies.append(time.perf_counter() - start)
+            sent = [m for m in fake_bot.sent[sent_before:] if m.chat.id == message.chat.id]
+            errors.extend(m for m in sent if m.text.startswith("❗"))
+            edits = sent[0].edits if sent else []
+            first_visible.append(edits[0][0] - start if edits else latencies[-1])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "messages": len(latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 3),
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "first_p50": round(percentile(first_visible, 50), 3),
+        "rss_mb": round(rss_mb(), 1),
+    }
+
+
+async def main():
+    args = parse_args()
+    configure_environment(args)
+
+    if args.retrieval_eval:
+        import agent
+        results = evaluate_retrieval(agent, load_eval_questions(args.retrieval_eval, args.seed), args.eval_batch)
+        print(f"\n{'режим':>10} {'вопросов':>9} {'секунд':>8} {'запросов эмб.':>14} {'hit@k':>6}")
+        for r in results:
+            print(f"{r['mode']:>10} {r['questions']:>9} {r['seconds']:>8} {r['embedding_requests']:>14} "
+                  f"{r[f'hit_at_{agent.RETRIEVER_K}']:>6}")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"args": vars(args), "retrieval": results}, f, ensure_ascii=False, indent=2)
+        return
+
+    queries = load_queries(args.queries, args.seed)
+
+    import bot as bot_module
+
+    start = time.perf_counter()
+    await bot_module.warm_up()
+    if bot_module.warmup_error is not None:
+        sys.exit(f"Не удалось загрузить агента: {bot_module.warmup_error}")
+    print(f"Загрузка компонентов: {time.perf_counter() - start:.2f} секунд, RSS {rss_mb():.1f} МБ")
+
+    results = []
+    for level, concurrency in enumerate(int(x) for x in args.levels.split(",")):
+        if not args.keep_caches:
+            bot_module.agent.answer_cache.clear()
+            bot_module.agent.embeddings.clear()
+        fake_bot = FakeBot()
+        result = await run_level(bot_module, fake_bot, queries, concurrency, args.turns, level)
+        results.append(result)
+
+    print(f"\n{'потоков':>8} {'сообщ.':>7} {'ошибок':>7} {'сообщ/с':>8} {'p50, с':>7} {'p95, с':>7} {'p99, с':>7} {'начало p50':>10} {'RSS, МБ':>8}")
+    for r in results:
+        print(f"{r['concurrency']:>8} {r['messages']:>7} {r['errors']:>7} {r['throughput']:>8} "
+              f"{r['p50']:>7} {r['p95']:>7} {r['p99']:>7} {r['first_p50']:>10} {r['rss_mb']:>8}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+    bot_module.agent_pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
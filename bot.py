@@ -1,41 +1,88 @@
+import time
+START_TIME = time.perf_counter()
+
 import os
 import asyncio
+import importlib
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
 from aiogram import Bot, Dispatcher, types
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 from aiogram.types import Message
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 import re
-import time
-from agent import city_agent
-from langchain_core.messages import HumanMessage
-from langchain_gigachat import GigaChatEmbeddings
+import toxicity_test
+from agent_pool import AgentPool, PoolOverloaded
+from session_store import SessionStore
+from metrics import request_trace, start_metrics_server, register_gauges, timed, observe
+from langchain_core.messages import HumanMessage, AIMessage
 import numpy as np
 from dotenv import load_dotenv
 load_dotenv()
 
 TG_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-
-GIGACHAT_EMBEDD_KEY = os.getenv("GIGACHAT_EMBEDDINGS_KEY")
-
-emb = GigaChatEmbeddings(
-    credentials=GIGACHAT_EMBEDD_KEY,
-    verify_ssl_certs=False
-)
+# 1 — начинать принимать сообщения сразу, а модели и базу загружать в фоне
+BACKGROUND_WARMUP = os.getenv("BACKGROUND_WARMUP", "1") == "1"
+# 1 — показывать ответ по мере генерации, редактируя сообщение «Думаю...»
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+# Не чаще одного изменения сообщения в секунду: ограничение Telegram для одного чата
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+TELEGRAM_MAX_LENGTH = 4096
+# Как часто удалять закончившиеся события афиши из базы, секунд (0 — не удалять)
+EXPIRY_COMPACTION_INTERVAL = float(os.getenv("EXPIRY_COMPACTION_INTERVAL", "3600"))
+
+agent = None  # модуль agent: GigaChat, Chroma и граф создаются при его импорте (см. warm_up)
+components_ready = asyncio.Event()
+warmup_error = None
+
+def load_components():
+    """Параллельно загружает агента (клиенты GigaChat, Chroma) и модель токсичности"""
+    global agent
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="warmup") as executor:
+        toxicity = executor.submit(toxicity_test.load_model)
+        agent_module = executor.submit(importlib.import_module, "agent")
+        agent = agent_module.result()
+        toxicity.result()
+
+async def warm_up():
+    global warmup_error
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, load_components)
+        print(f"Бот готов к работе через {time.perf_counter() - START_TIME:.2f} секунд после запуска")
+    except Exception as e:
+        warmup_error = e
+        print(f"Ошибка загрузки агента: {e}")
+    finally:
+        components_ready.set()
+
+async def compaction_loop():
+    """Периодически удаляет закончившиеся события афиши (см. agent.compact_expired_events)"""
+    await components_ready.wait()
+    loop = asyncio.get_running_loop()
+    while agent is not None:
+        try:
+            await loop.run_in_executor(None, agent.compact_expired_events)
+        except Exception as e:
+            print(f"Ошибка удаления устаревших событий: {e}")
+        await asyncio.sleep(EXPIRY_COMPACTION_INTERVAL)
 
 def embed_text(text: str) -> np.ndarray:
-    """Преобразование текста в эмбеддинг"""
-    return np.array(emb.embed_query(text))
+    """Преобразование текста в эмбеддинг (через общий с агентом кэш)"""
+    return np.array(agent.embeddings.embed_query(text))
 
 def cosine_similarity(a, b):
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
+@timed("topic_check")
 def is_topic_changed(prev_text: str, curr_text: str, threshold: float = 0.8) -> bool:
     try:
         v1 = embed_text(prev_text)
         v2 = embed_text(curr_text)
         sim = cosine_similarity(v1, v2)
-        print(f"[topic similarity] {sim:.3f}")
+        observe("topic_similarity", float(sim))
 
         return sim < threshold
 
@@ -55,6 +102,91 @@ def clean_html(text: str) -> str:
     cleaned = re.sub(r"</?([a-zA-Z0-9]+)[^>]*>", replace_tag, text)
     return cleaned
 
+def format_answer(text: str) -> str:
+    """Ответ агента в виде для Telegram: разрешённые теги, без # и ссылок на фрагменты"""
+    answer_text = clean_html(text)
+    answer_text = answer_text.replace("#", "")
+    return re.sub(r'\[Фрагмент \d\]', '', answer_text)
+
+def partial_html(text: str) -> str:
+    """
+    Недописанный ответ для промежуточного показа: без оборванного в конце тега
+    или HTML-сущности, с закрытыми открытыми тегами (иначе Telegram не примет разметку)
+    """
+    text = text[:TELEGRAM_MAX_LENGTH - 200]
+    text = re.sub(r"<[^>]*$", "", text)
+    text = re.sub(r"&[#\w]*$", "", text)
+    text = re.sub(r"\[[^\]]*$", "", format_answer(text))
+
+    open_tags = []
+    for closing, tag in re.findall(r"<(/?)([a-zA-Z0-9]+)[^>]*>", text):
+        tag = tag.lower()
+        if not closing:
+            open_tags.append(tag)
+        elif tag in open_tags:
+            del open_tags[len(open_tags) - 1 - open_tags[::-1].index(tag)]
+    return text.strip() + "".join(f"</{tag}>" for tag in reversed(open_tags)) + " ▌"
+
+class StreamingReply:
+    """
+    Постепенно показывает ответ в сообщении-заглушке. Текст приходит из рабочего
+    потока агента (push), а сообщение редактируется не чаще раза в interval секунд —
+    промежуточные версии между правками пропускаются
+    """
+
+    def __init__(self, placeholder, interval=STREAM_EDIT_INTERVAL):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.loop = asyncio.get_running_loop()
+        self.text = ""
+        self.shown = ""
+        self.changed = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    def push(self, text: str):
+        """Вызывается из рабочего потока с накопленным текстом ответа"""
+        self.loop.call_soon_threadsafe(self._update, text)
+
+    def _update(self, text):
+        self.text = text
+        self.changed.set()
+
+    async def run(self):
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+            html = partial_html(self.text)
+            if html != self.shown:
+                await self.edit(html)
+            await asyncio.sleep(self.interval)
+
+    async def edit(self, html: str) -> bool:
+        for attempt in range(2):
+            try:
+                await self.placeholder.edit_text(html)
+                self.shown = html
+                return True
+            except TelegramRetryAfter as e:
+                if attempt == 1:
+                    return False
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    return True
+                print(f"Не удалось изменить сообщение: {e}")
+                return False
+        return False
+
+    async def stop(self):
+        self.task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self.task
+
+    async def finish(self, html: str) -> bool:
+        """Показывает итоговый ответ вместо промежуточного; False — если изменить сообщение не удалось"""
+        await self.stop()
+        return await self.edit(html)
+
 user_state = {} 
 
 TOKEN = TG_TOKEN
@@ -77,18 +209,28 @@ async def cmd_start(message: Message):
     )
 
 
-user_states = {}  # user_id -> AgentState
+sessions = SessionStore()  # user_id -> AgentState, см. session_store
 
-@dp.message()
-async def handle_message(message: Message):
-    start_time = time.perf_counter()
-    user_id = message.from_user.id
-    user_text = message.text
+agent_pool = AgentPool()
+register_gauges("agent_pool", lambda: {"pending": agent_pool.pending})
+register_gauges("sessions", sessions.metrics)
 
-    if user_id not in user_states:
-        user_states[user_id] = {"messages": []}
+def process_turn(user_id: int, user_text: str, on_text=None) -> str:
+    """
+    Обрабатывает одно сообщение пользователя (выполняется в пуле потоков).
+    on_text получает текст ответа по мере генерации (см. agent.answer_stream)
+    """
+    if warmup_error is not None:
+        raise RuntimeError(f"агент не загружен: {warmup_error}")
+    with request_trace(user_id=user_id):
+        token = agent.answer_stream.set(on_text)
+        try:
+            return run_turn(user_id, user_text)
+        finally:
+            agent.answer_stream.reset(token)
 
-    state = user_states[user_id]
+def run_turn(user_id: int, user_text: str) -> str:
+    state = sessions.get(user_id)
 
     if state["messages"]:
         last_user_msg = None
@@ -96,7 +238,6 @@ async def handle_message(message: Message):
         for msg in reversed(state["messages"]):
             if msg.type == "human":
                 last_user_msg = msg.content
-                print(f"СООБЩЕНИЕ ПОЛЬЗОВАТЕЛЯ АХАХАХАХ {last_user_msg}")
                 break
 
         if last_user_msg:
@@ -108,28 +249,52 @@ async def handle_message(message: Message):
 
     state["messages"].append(HumanMessage(content=user_text))
 
-    await message.answer("⏳ Думаю...")
+    result = agent.city_agent.invoke(state)
 
-    try:
-        result = city_agent.invoke(state)
+    # В сессии сохраняется весь диалог: ответы модели и результаты инструментов нужны
+    # для следующих вопросов, сжатия истории и исключения уже показанных фрагментов
+    state["messages"] = list(result["messages"])
+    answer_message = state["messages"][-1]
+
+    if answer_message.type == "human":
+        # Токсичное сообщение: граф завершился без ответа модели
+        answer_message = AIMessage(
+            content="Вы слишком грубы! Общайтесь вежливее, мы же говорим о культурной столице!"
+        )
+        state["messages"].append(answer_message)
+
+    sessions.save(user_id, state)
+
+    return format_answer(answer_message.content)
+
+@dp.message()
+async def handle_message(message: Message):
+    start_time = time.perf_counter()
+    user_id = message.from_user.id
+    user_text = message.text
 
-        answer_message = result["messages"][-1]
+    if not agent_pool.has_capacity(user_id):
+        await message.answer("⏳ Сейчас слишком много запросов, попробуйте чуть позже")
+        return
 
-        if answer_message.content == user_text:
-            answer_message.content = (
-                "Вы слишком грубы! Общайтесь вежливее, мы же говорим о культурной столице!"
-            )
-            state["messages"].append(answer_message)
+    placeholder = await message.answer("⏳ Думаю...")
 
-        answer_text = clean_html(answer_message.content)
-        answer_text = answer_text.replace("#", "")
-        final_answer = re.sub(r'\[Фрагмент \d\]', '', answer_text)
+    reply = StreamingReply(placeholder) if STREAM_ANSWERS else None
+    try:
+        # Сообщения, пришедшие до окончания загрузки, ждут её в очереди пула
+        final_answer = await agent_pool.run(
+            user_id, process_turn, user_id, user_text, reply.push if reply else None, ready=components_ready
+        )
 
         end_time = time.perf_counter()
         duration = end_time - start_time
-        print(f"Время ответа агента - {duration:.4f} секунд")
 
-        await message.answer(final_answer + f"\n\nДумал {duration:.4f} секунд")
+        answer_text = final_answer + f"\n\nДумал {duration:.4f} секунд"
+        if reply is None or not await reply.finish(answer_text):
+            await message.answer(answer_text)
+
+    except PoolOverloaded:
+        await message.answer("⏳ Сейчас слишком много запросов, попробуйте чуть позже")
 
     except Exception as e:
         print(f"Ошибка LLM/агента: {e}")
@@ -137,10 +302,71 @@ async def handle_message(message: Message):
             "❗ Произошла ошибка при обработке запроса.\nПопробуйте ещё раз"
         )
 
+    finally:
+        if reply is not None:
+            await reply.stop()
+
+
+def start_background_tasks(run_compaction=True):
+    """Фоновая загрузка компонентов и периодическое удаление устаревших событий"""
+    warmup_task = asyncio.create_task(warm_up())
+    compaction_task = None
+    if run_compaction and EXPIRY_COMPACTION_INTERVAL > 0:
+        compaction_task = asyncio.create_task(compaction_loop())
+    return warmup_task, compaction_task
 
 async def main():
+    start_metrics_server()
+    warmup_task, compaction_task = start_background_tasks()
+    if not BACKGROUND_WARMUP:
+        await warmup_task
     print("Бот запущен!")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if compaction_task is not None:
+            compaction_task.cancel()
+        agent_pool.shutdown()
+
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # как в webhook.py: воркер проверяет его сам
+
+async def serve_webhook(host="127.0.0.1", port=8100, metrics_port=0, run_compaction=False):
+    """
+    Режим воркера за балансировщиком webhook.py: обновления Telegram приходят
+    POST-запросами на WEBHOOK_PATH (с заголовком секрета, если задан WEBHOOK_SECRET),
+    GET /health отвечает 200, когда агент загружен.
+    Устаревшие события по умолчанию не удаляются: базу Chroma открывают все воркеры,
+    чистка выполняется до их запуска (webhook.py --compact)
+    """
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+    async def health(request):
+        # 200 — готов, 503 — агент ещё загружается, 500 — загрузка не удалась
+        if warmup_error is not None:
+            status = 500
+        else:
+            status = 200 if components_ready.is_set() else 503
+        return web.json_response({"ready": status == 200, "pending": agent_pool.pending}, status=status)
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None).register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/health", health)
+
+    start_metrics_server(metrics_port)
+    _, compaction_task = start_background_tasks(run_compaction)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Воркер принимает обновления на {host}:{port}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        if compaction_task is not None:
+            compaction_task.cancel()
+        await runner.cleanup()
+        agent_pool.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,87 @@
+import os
+from collections import OrderedDict
+from knowledge_base import CHUNK_OVERLAP
+from history_compaction import estimate_tokens, CHARS_PER_TOKEN, TRUNCATED_MARK
+from dotenv import load_dotenv
+load_dotenv()
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2500"))  # токенов на один ответ инструмента
+MIN_OVERLAP = 10  # более короткое совпадение считаем случайным
+
+NOTHING_FOUND = "Релевантной информации в документе не найдено"
+NOTHING_NEW = "Новой информации не найдено: все найденные фрагменты уже приведены выше в диалоге"
+
+
+def remove_overlap(previous, text, max_overlap=CHUNK_OVERLAP * 2):
+    """Убирает из начала text кусок, которым заканчивается previous (перекрытие соседних фрагментов)"""
+    for size in range(min(len(previous), len(text), max_overlap), MIN_OVERLAP - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:].lstrip()
+    return text
+
+
+def merge_entry(docs):
+    """Склеивает фрагменты одной записи по порядку, без повторов на стыках"""
+    docs = sorted(docs, key=lambda doc: doc.metadata.get("chunk", 0))
+    text = docs[0].page_content
+    for prev, doc in zip(docs, docs[1:]):
+        if doc.metadata.get("chunk", 0) == prev.metadata.get("chunk", 0) + 1:
+            text += " " + remove_overlap(prev.page_content, doc.page_content)
+        else:
+            text += "\n…\n" + doc.page_content
+    return text
+
+
+def assemble_context(docs, seen_ids=(), max_tokens=CONTEXT_TOKEN_BUDGET):
+    """
+    Собирает ответ инструмента поиска: фрагменты, уже показанные в диалоге (seen_ids),
+    пропускаются, соседние фрагменты одной записи склеиваются без перекрытия,
+    общий объём ограничивается max_tokens. Порядок — по релевантности первого
+    фрагмента записи. Возвращает текст и список вошедших в него документов.
+    """
+    if not docs:
+        return NOTHING_FOUND, []
+
+    fresh = [doc for doc in docs if doc.id is None or doc.id not in seen_ids]
+    if not fresh:
+        return NOTHING_NEW, []
+
+    entries = OrderedDict()
+    for doc in fresh:
+        key = (doc.metadata.get("source"), doc.metadata.get("entry_id"))
+        entries.setdefault(key, []).append(doc)
+
+    results = []
+    used = []
+    budget = max_tokens
+    for entry_docs in entries.values():
+        text = merge_entry(entry_docs)
+        tokens = estimate_tokens(text)
+        if tokens > budget:
+            if budget < 100:
+                break
+            text = text[:budget * CHARS_PER_TOKEN - len(TRUNCATED_MARK)] + TRUNCATED_MARK
+            tokens = budget
+        results.append(f"Фрагмент {len(results) + 1}:\n{text}")
+        used.extend(entry_docs)
+        budget -= tokens
+
+    return "\n\n".join(results), used
+
+
+def context_artifact(docs):
+    """Что запоминается в ToolMessage.artifact: источники и id показанных фрагментов"""
+    return {
+        "sources": sorted({doc.metadata.get("source") or "" for doc in docs}),
+        "chunk_ids": [doc.id for doc in docs if doc.id is not None],
+    }
+
+
+def seen_chunk_ids(messages):
+    """id фрагментов, уже показанных модели в этом диалоге (обрезанные ответы не считаются)"""
+    seen = set()
+    for msg in messages:
+        artifact = getattr(msg, "artifact", None)
+        if msg.type == "tool" and isinstance(artifact, dict) and not str(msg.content).endswith(TRUNCATED_MARK):
+            seen.update(artifact.get("chunk_ids", []))
+    return seen
@@ -0,0 +1,135 @@
+import os
+import re
+import json
+import hashlib
+
+# Корпус — файлы JSONL, по записи в строке: {"source": ..., "id": ..., "fields": {поле: значение}}.
+# Источник называется по имени прежнего текстового файла (afisha_events.txt и т.п.),
+# файл корпуса лежит рядом с расширением .jsonl. Если его ещё нет, читается текстовый файл.
+
+# Поля записей, которые пишут парсеры (нужны для разбора текстовых файлов)
+KNOWN_FIELDS = {
+    "Название", "Описание", "Основная часть", "URL", "Дата начала", "Дата окончания",
+    "Возрастное ограничение", "Категория", "Категории", "Название локации", "Адрес", "Район",
+    "Ссылка", "Время работы", "Доступность", "Ближайшее метро", "Телефон",
+}
+RECORD_START = re.compile(r"^\s*(?:===\s*)?Запись\s*\d+\s*(?:===)?\s*$")
+FIELD_LINE = re.compile(r"^([^:\n]{1,40}):\s?(.*)$")
+
+
+def corpus_path(source):
+    return os.path.splitext(source)[0] + ".jsonl"
+
+
+def corpus_file(source):
+    """Файл, из которого читается источник: JSONL, если он есть, иначе текстовый"""
+    path = corpus_path(source)
+    return path if os.path.exists(path) else source
+
+
+def record_id(source, fields, seen):
+    """
+    Стабильный идентификатор записи по источнику и содержимому; seen — счётчик
+    уже выданных идентификаторов, чтобы одинаковые записи получили разные id
+    """
+    raw = json.dumps([source, fields], ensure_ascii=False, sort_keys=True)
+    key = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+    occurrence = seen.get(key, 0)
+    seen[key] = occurrence + 1
+    return key if occurrence == 0 else f"{key}-{occurrence}"
+
+
+def record_text(fields):
+    """Текст записи для векторной базы — «Поле: значение» по строкам"""
+    return "\n".join(f"{key}: {value}" for key, value in fields.items() if value not in (None, ""))
+
+
+class CorpusWriter:
+    """
+    Построчная запись источника в JSONL. Пишется во временный файл, который
+    заменяет прежний только после успешного завершения (with CorpusWriter(...) as w).
+    """
+
+    def __init__(self, source, path=None):
+        self.source = source
+        self.path = path or corpus_path(source)
+        self.tmp_path = self.path + ".tmp"
+        self.seen = {}
+        self.count = 0
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.tmp_path, "w", encoding="utf-8")
+        return self
+
+    def write(self, fields, key=None):
+        """Дописывает запись; без key идентификатор считается по содержимому"""
+        if key is None:
+            key = record_id(self.source, fields, self.seen)
+        record = {"source": self.source, "id": str(key), "fields": fields}
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+
+def read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                print(f"Пропущена повреждённая строка {line_number} в {path} - {e}")
+
+
+def read_text(path, source):
+    """Записи текстового файла «Запись N / Поле: значение», по одной, без чтения файла целиком"""
+    seen = {}
+
+    def finish(fields):
+        return {"source": source, "id": record_id(source, fields, seen), "fields": fields}
+
+    fields, key = {}, None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if RECORD_START.match(line):
+                if fields:
+                    yield finish(fields)
+                fields, key = {}, None
+                continue
+            if set(line.strip()) == {"-"}:  # разделитель записей
+                continue
+            match = FIELD_LINE.match(line)
+            if match and match.group(1) in KNOWN_FIELDS:
+                key = match.group(1)
+                fields[key] = match.group(2).strip()
+            elif key is not None and line.strip():
+                fields[key] += "\n" + line.strip()
+    if fields:
+        yield finish(fields)
+
+
+def read_source(source):
+    """Генератор записей источника: из JSONL, а если его нет — из текстового файла"""
+    path = corpus_file(source)
+    if path.endswith(".jsonl"):
+        return read_jsonl(path)
+    return read_text(path, source)
+
+
+if __name__ == "__main__":
+    # Перевод текстовых файлов в JSONL: python corpus.py afisha_events.txt mfc_info.txt ...
+    import sys
+    for source in sys.argv[1:]:
+        with CorpusWriter(source) as writer:
+            for record in read_text(source, source):
+                writer.write(record["fields"], record["id"])
+        print(f"{source} -> {writer.path}: {writer.count} записей")
@@ -0,0 +1,101 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from metrics import timed, trace_add
+from dotenv import load_dotenv
+load_dotenv()
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "5000"))
+
+
+def normalize_text(text):
+    """Ключ кэша: текст без лишних пробелов и переносов строк"""
+    return " ".join(text.split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Обёртка над эмбеддингами с LRU-кэшем запросов: каждый различный текст
+    отправляется в API не более одного раза, пока не будет вытеснен.
+    Векторы хранятся в float32, в кэше не больше max_size записей.
+    embed_documents (построение индекса) не кэшируется.
+    """
+
+    def __init__(self, base, max_size=EMBED_CACHE_SIZE):
+        self.base = base
+        self.max_size = max_size
+        self.entries = OrderedDict()  # нормализованный текст -> np.ndarray
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = normalize_text(text)
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return vector.tolist()
+            self.stats["misses"] += 1
+
+        trace_add("embedding_calls")
+        vector = np.asarray(timed("embedding")(self.base.embed_query)(key), dtype=np.float32)
+
+        with self.lock:
+            self.entries[key] = vector
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evicted"] += 1
+        return vector.tolist()
+
+    def embed_queries(self, texts):
+        """
+        Эмбеддинги нескольких запросов (матрица float32, строка на запрос): найденные
+        в кэше берутся из него, остальные отправляются в API одним запросом
+        """
+        keys = [normalize_text(text) for text in texts]
+        vectors = {}
+        with self.lock:
+            for key in keys:
+                vector = self.entries.get(key)
+                if vector is not None:
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    vectors[key] = vector
+            missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+            self.stats["misses"] += len(missing)
+
+        if missing:
+            trace_add("embedding_calls")
+            computed = timed("embedding")(self._embed_query_batch)(missing)
+            with self.lock:
+                for key, vector in zip(missing, computed):
+                    vectors[key] = self.entries[key] = np.asarray(vector, dtype=np.float32)
+                    self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+                    self.stats["evicted"] += 1
+
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
+
+    def _embed_query_batch(self, texts):
+        """embed_query для нескольких текстов одним запросом к API (с префиксом запроса, если он есть)"""
+        if getattr(self.base, "use_prefix_query", False):
+            texts = [self.base.prefix_query + text for text in texts]
+        return self.base.embed_documents(texts)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def metrics(self):
+        with self.lock:
+            return {**self.stats, "size": len(self.entries)}
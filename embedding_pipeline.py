@@ -0,0 +1,138 @@
+import os
+import glob
+import time
+import random
+import hashlib
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from rate_limit import TokenBucket
+from dotenv import load_dotenv
+load_dotenv()
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+EMBED_RATE_LIMIT = float(os.getenv("EMBED_RATE_LIMIT", "5"))  # запросов в секунду
+EMBED_RETRIES = int(os.getenv("EMBED_RETRIES", "5"))
+
+
+def batched(items, batch_size):
+    """Нарезает любую последовательность (в том числе генератор) на пачки"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_checkpoints(checkpoint_dir):
+    """Читает уже посчитанные эмбеддинги: id фрагмента -> вектор"""
+    done = {}
+    if not checkpoint_dir or not os.path.isdir(checkpoint_dir):
+        return done
+    for path in glob.glob(os.path.join(checkpoint_dir, "*.npz")):
+        try:
+            with np.load(path) as data:
+                done.update(zip(data["ids"].tolist(), data["vectors"].tolist()))
+        except Exception as e:
+            print(f"Повреждённый чекпоинт {path} пропущен - {e}")
+    return done
+
+
+def save_checkpoint(checkpoint_dir, ids, vectors):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    name = hashlib.sha256("\n".join(ids).encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(checkpoint_dir, f"{name}.npz")
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, ids=np.array(ids), vectors=np.asarray(vectors, dtype=np.float32))
+    os.replace(tmp_path, path)
+
+
+def clear_checkpoints(checkpoint_dir):
+    for path in glob.glob(os.path.join(checkpoint_dir, "*.npz")):
+        os.remove(path)
+
+
+def embed_with_retry(embeddings, texts, limiter, retries=EMBED_RETRIES, backoff=1.0):
+    """Один запрос к API эмбеддингов с повторами и экспоненциальной задержкой"""
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt * (1 + random.random())
+            print(f"Ошибка эмбеддинга ({e}), повтор через {delay:.1f} с")
+            time.sleep(delay)
+
+
+def embed_documents(docs, embeddings, on_batch, batch_size=EMBED_BATCH_SIZE,
+                    workers=EMBED_WORKERS, rate_limit=EMBED_RATE_LIMIT,
+                    retries=EMBED_RETRIES, checkpoint_dir=None):
+    """
+    Считает эмбеддинги документов пачками по batch_size в workers потоков
+    с ограничением частоты запросов rate_limit. Для каждой готовой пачки вызывается
+    on_batch(docs, vectors). docs может быть генератором, у каждого документа
+    должен быть id. Если задан checkpoint_dir, готовые пачки сохраняются на диск,
+    и при повторном запуске после сбоя уже посчитанные документы не отправляются
+    в API. Возвращает количество документов, для которых вызывался API.
+    """
+    limiter = TokenBucket(rate_limit, capacity=workers)
+    done = load_checkpoints(checkpoint_dir)
+    if done:
+        print(f"Найдено {len(done)} эмбеддингов из прошлого запуска")
+
+    def process(batch):
+        todo = [doc for doc in batch if doc.id not in done]
+        fresh = {}
+        if todo:
+            vectors = embed_with_retry(embeddings, [doc.page_content for doc in todo], limiter, retries)
+            if checkpoint_dir:
+                save_checkpoint(checkpoint_dir, [doc.id for doc in todo], vectors)
+            fresh = dict(zip([doc.id for doc in todo], vectors))
+        return batch, [fresh[doc.id] if doc.id in fresh else done[doc.id] for doc in batch], len(todo)
+
+    stats = {"embedded": 0, "processed": 0, "batches": 0}
+
+    def collect(future):
+        batch_docs, vectors, count = future.result()
+        on_batch(batch_docs, vectors)
+        stats["embedded"] += count
+        stats["processed"] += len(batch_docs)
+        stats["batches"] += 1
+        if stats["batches"] % 10 == 0:
+            print(f"Обработано фрагментов: {stats['processed']}")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as executor:
+        in_flight = set()
+        for batch in batched(docs, batch_size):
+            in_flight.add(executor.submit(process, batch))
+            if len(in_flight) < workers * 2:
+                continue
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                collect(future)
+
+        for future in in_flight:
+            collect(future)
+
+    print(f"Обработано фрагментов: {stats['processed']}, запрошено эмбеддингов: {stats['embedded']}")
+    return stats["embedded"]
+
+
+if __name__ == "__main__":
+    # Офлайн-замер конвейера на фейковых эмбеддингах: python embedding_pipeline.py
+    from langchain_core.documents import Document
+    from fakes import FakeEmbeddings
+
+    docs = [Document(id=str(i), page_content=f"Фрагмент {i}") for i in range(2000)]
+
+    for workers in (1, 2, 4, 8):
+        fake = FakeEmbeddings(size=256, latency=0.05, failure_rate=0.01)
+        start = time.perf_counter()
+        embed_documents(docs, fake, on_batch=lambda batch, vectors: None,
+                        batch_size=32, workers=workers, rate_limit=0, retries=5)
+        duration = time.perf_counter() - start
+        print(f"workers={workers}: {duration:.2f} с, {len(docs) / duration:.0f} фрагментов/с, запросов {fake.calls}")
@@ -0,0 +1,241 @@
+# Локальные заменители внешних сервисов для офлайн-замеров и отладки без ключей GigaChat
+import json
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatResult, ChatGeneration, ChatGenerationChunk
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Детерминированные эмбеддинги по хешу текста. latency имитирует задержку
+    одного запроса к API, failure_rate — долю запросов, завершающихся ошибкой.
+    """
+
+    def __init__(self, size=1024, latency=0.0, failure_rate=0.0, seed=0):
+        self.size = size
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        rng = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+        vector = rng.standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _request(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise ConnectionError("Имитация сбоя сервиса эмбеддингов")
+
+    def embed_documents(self, texts):
+        self._request()
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self._request()
+        return self._vector(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Детерминированная замена GigaChat: на вопрос пользователя вызывает retriever_tool
+    с текстом вопроса, после ответа инструмента пишет ответ по первому фрагменту
+    (с HTML-разметкой, как настоящая модель). latency — задержка одного вызова;
+    в потоковом режиме первый фрагмент приходит через пятую часть latency.
+    """
+
+    latency: float = 0.0
+    model: str = "fake"
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._answer(messages))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._answer(messages)
+        if message.tool_calls:
+            if self.latency:
+                time.sleep(self.latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="", usage_metadata=message.usage_metadata,
+                tool_call_chunks=[{"name": call["name"], "args": json.dumps(call["args"], ensure_ascii=False),
+                                   "id": call["id"], "index": i} for i, call in enumerate(message.tool_calls)]
+            ))
+            return
+
+        words = str(message.content).split(" ")
+        for i, word in enumerate(words):
+            if self.latency:
+                time.sleep(self.latency / 5 if i == 0 else self.latency * 4 / 5 / max(1, len(words) - 1))
+            chunk = AIMessageChunk(content=word if i == 0 else " " + word)
+            if i == len(words) - 1:
+                chunk.usage_metadata = message.usage_metadata
+            yield ChatGenerationChunk(message=chunk)
+
+    def _answer(self, messages):
+        last = messages[-1]
+        prompt_tokens = sum(len(str(message.content)) for message in messages) // 4
+        if last.type == "human":
+            message = AIMessage(
+                content="",
+                tool_calls=[{"name": "retriever_tool", "args": {"query": last.content},
+                             "id": f"call_{len(messages)}", "type": "tool_call"}]
+            )
+        else:
+            fragment = str(last.content).split("\n\n")[0][:600]
+            message = AIMessage(content=f"<p><b>Вот что удалось найти:</b></p>\n{fragment}\n[Фрагмент 1]")
+
+        completion_tokens = len(str(message.content)) // 4 + 1
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return message
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeBot:
+    """Замена aiogram.Bot: запоминает отправленные сообщения вместо обращения к Telegram"""
+
+    def __init__(self):
+        self.sent = []
+        self.next_message_id = 1
+
+    async def send_message(self, chat_id, text, **kwargs):
+        message = FakeMessage(self, chat_id, text, message_id=self.next_message_id)
+        self.next_message_id += 1
+        self.sent.append(message)
+        return message
+
+
+class FakeMessage:
+    """Входящее или отправленное сообщение с интерфейсом aiogram.types.Message"""
+
+    def __init__(self, bot, user_id, text, message_id=0):
+        self.bot = bot
+        self.from_user = FakeUser(user_id)
+        self.chat = FakeUser(user_id)
+        self.text = text
+        self.message_id = message_id
+        self.edits = []  # (time.perf_counter(), текст) каждого изменения сообщения
+
+    async def answer(self, text, **kwargs):
+        return await self.bot.send_message(self.chat.id, text, **kwargs)
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+        self.edits.append((time.perf_counter(), text))
+        return self
+
+
+class FakeCityApi:
+    """
+    Локальный HTTP-сервер с API yazzh.gate.petersburg.ru (/beautiful_places/, /afisha/all/,
+    /mfc/all/) и сгенерированными данными. latency — задержка каждого ответа,
+    failure_rate — доля ответов 503. Используется как контекстный менеджер, адрес — url.
+    """
+
+    def __init__(self, places=700, events=850, mfc=70, latency=0.0, failure_rate=0.0, seed=0):
+        self.places = [
+            {"place": {"title": f"Место {i}", "description": f"Описание места {i}", "district": "Центральный",
+                       "address": f"ул. Тестовая, {i}", "categories": ["Природа"], "data_source": ""}}
+            for i in range(places)
+        ]
+        self.events = [
+            {"place": {"title": f"Событие {i}", "description": f"Описание события {i}",
+                       "start_date": "2025-12-18T16:00:00Z", "end_date": "2025-12-18T18:00:00Z",
+                       "age": "6+", "categories": ["Театр"], "location_title": "Дом культуры",
+                       "address": f"пр. Тестовый, {i}"}}
+            for i in range(events)
+        ]
+        self.mfc = [
+            {"name": f"МФЦ Центрального района Сектор № {i}", "address": f"ул. Тестовая, {i}",
+             "working_hours": "Ежедневно с 09.30 до 21.00", "accessible_env": [], "link": "",
+             "nearest_metro": "Невский проспект", "phone": ["+7 (812) 000-00-00"]}
+            for i in range(mfc)
+        ]
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = None
+
+    def _page(self, items, query):
+        page = int(query.get("page", ["1"])[0])
+        count = int(query.get("count", ["10"])[0])
+        return {"count": len(items), "data": items[(page - 1) * count:page * count]}
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего сервера
+
+            def do_GET(self):
+                with api.lock:
+                    api.requests += 1
+                    failed = api.failure_rate and api.random.random() < api.failure_rate
+                if api.latency:
+                    time.sleep(api.latency)
+
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if failed:
+                    status, payload = 503, {"error": "Имитация сбоя"}
+                elif url.path == "/beautiful_places/":
+                    status, payload = 200, api._page(api.places, query)
+                elif url.path == "/afisha/all/":
+                    status, payload = 200, api._page(api.events, query)
+                elif url.path == "/mfc/all/":
+                    status, payload = 200, {"count": len(api.mfc), "data": api.mfc}
+                else:
+                    status, payload = 404, {"error": "Not found"}
+
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,82 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+HISTORY_KEEP_EXCHANGES = int(os.getenv("HISTORY_KEEP_EXCHANGES", "2"))  # последних обменов без изменений
+LLM_TOKEN_BUDGET = int(os.getenv("LLM_TOKEN_BUDGET", "12000"))  # токенов на сообщения одного вызова LLM
+CHARS_PER_TOKEN = 3  # грубая оценка для русского текста, без обращения к API токенизатора
+TRUNCATED_MARK = " …[сокращено]"
+
+
+def estimate_tokens(text):
+    return len(str(text)) // CHARS_PER_TOKEN + 1
+
+
+def count_tokens(messages):
+    return sum(estimate_tokens(msg.content) for msg in messages)
+
+
+def split_exchanges(messages):
+    """Делит историю на обмены: вопрос пользователя и всё, что было после него"""
+    exchanges = []
+    for msg in messages:
+        if msg.type == "human" or not exchanges:
+            exchanges.append([])
+        exchanges[-1].append(msg)
+    return exchanges
+
+
+def compact_exchange(exchange):
+    """Из старого обмена остаются вопрос и итоговый ответ, вызовы инструментов и их результаты выбрасываются"""
+    return [
+        msg for msg in exchange
+        if msg.type == "human" or (msg.type == "ai" and not getattr(msg, "tool_calls", None))
+    ]
+
+
+def _shrink(msg, tokens_to_cut):
+    content = str(msg.content)
+    keep_chars = max(0, len(content) - tokens_to_cut * CHARS_PER_TOKEN - len(TRUNCATED_MARK))
+    return msg.model_copy(update={"content": content[:keep_chars] + TRUNCATED_MARK})
+
+
+def compact_history(messages, keep_exchanges=HISTORY_KEEP_EXCHANGES, max_tokens=LLM_TOKEN_BUDGET):
+    """
+    Сокращает историю перед вызовом LLM: последние keep_exchanges обменов остаются
+    как есть, в более старых убираются результаты инструментов. Если история всё
+    равно больше max_tokens, отбрасываются самые старые обмены, затем обрезаются
+    результаты инструментов (последний раунд поиска — в последнюю очередь).
+    Возвращает новый список сообщений и число сэкономленных токенов.
+    """
+    messages = list(messages)
+    before = count_tokens(messages)
+
+    exchanges = split_exchanges(messages)
+    keep = max(1, keep_exchanges)
+    older = [compact_exchange(exchange) for exchange in exchanges[:-keep]]
+    recent = [msg for exchange in exchanges[-keep:] for msg in exchange]
+
+    while older and count_tokens([msg for exchange in older for msg in exchange] + recent) > max_tokens:
+        older.pop(0)
+    result = [msg for exchange in older for msg in exchange] + recent
+
+    excess = count_tokens(result) - max_tokens
+    if excess > 0:
+        last_round = set()
+        for i in range(len(result) - 1, -1, -1):
+            if result[i].type != "tool":
+                break
+            last_round.add(i)
+        tool_indexes = [i for i, msg in enumerate(result) if msg.type == "tool"]
+        ordered = [i for i in tool_indexes if i not in last_round] + sorted(last_round)
+        for i in ordered:
+            if excess <= 0:
+                break
+            can_cut = estimate_tokens(result[i].content) - 50
+            if can_cut <= 0:
+                continue
+            cut = min(can_cut, excess)
+            result[i] = _shrink(result[i], cut)
+            excess -= cut
+
+    return result, max(0, before - count_tokens(result))
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import random
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from rate_limit import TokenBucket
+from dotenv import load_dotenv
+load_dotenv()
+
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", "8"))  # одновременных запросов
+HTTP_RATE_LIMIT = float(os.getenv("HTTP_RATE_LIMIT", "10"))  # запросов в секунду, 0 — без ограничения
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "4"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", "data/http_cache")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpFetcher:
+    """
+    HTTP-клиент для парсеров: общий пул соединений (requests.Session), не больше
+    workers запросов одновременно, не больше rate_limit запросов в секунду,
+    повторы с экспоненциальной задержкой при сетевых ошибках и ответах 429/5xx.
+    base_url позволяет направить парсер на локальный тестовый сервер (см. fakes.FakeCityApi).
+    """
+
+    def __init__(self, base_url="", headers=None, workers=HTTP_WORKERS, rate_limit=HTTP_RATE_LIMIT,
+                 retries=HTTP_RETRIES, timeout=HTTP_TIMEOUT, backoff=0.5):
+        self.base_url = base_url.rstrip("/")
+        self.workers = workers
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.limiter = TokenBucket(rate_limit, capacity=workers)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(headers or {})
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+
+    def url(self, path):
+        return path if path.startswith("http") else self.base_url + path
+
+    def get(self, path, params=None, headers=None):
+        """GET с повторами; возвращает requests.Response или бросает последнюю ошибку"""
+        url = self.url(path)
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            delay = self.backoff * 2 ** attempt * (1 + random.random())
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    response.raise_for_status()
+                    return response
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                print(f"Ответ {response.status_code} от {url}, повтор через {delay:.1f} с")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                print(f"Ошибка соединения с {url} ({e}), повтор через {delay:.1f} с")
+            time.sleep(delay)
+
+    def get_json(self, path, params=None):
+        return self.get(path, params=params).json()
+
+    def map(self, func, items):
+        """Выполняет func для каждого элемента в пуле потоков, результаты — в исходном порядке"""
+        return list(self.imap(func, items))
+
+    def imap(self, func, items):
+        """Как map, но отдаёт результаты по мере готовности (в исходном порядке)"""
+        return self.executor.map(func, items)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HttpCache:
+    """
+    Кэш на диске для условных запросов: для каждого URL хранятся ETag, Last-Modified
+    и результат обработки страницы. Если сервер ответил 304 Not Modified, страница
+    не скачивается и не разбирается заново — берётся сохранённый результат.
+    """
+
+    def __init__(self, cache_dir=HTTP_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest()[:32] + ".json")
+
+    def get(self, url):
+        try:
+            with open(self.path(url), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url, response, data):
+        entry = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "data": data,
+        }
+        if not entry["etag"] and not entry["last_modified"]:
+            return
+        tmp_path = self.path(url) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path(url))
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+
+if __name__ == "__main__":
+    # Офлайн-замер API_parser на локальном тестовом сервере: python http_fetcher.py
+    import API_parser
+    from fakes import FakeCityApi
+
+    with FakeCityApi(places=700, events=850, mfc=70, latency=0.05, failure_rate=0.02) as api:
+        # Первая строка — как раньше: по одному запросу, афиша по 10 событий на страницу
+        for workers, afisha_page_size in ((1, 10), (8, 10), (8, 100)):
+            with HttpFetcher(api.url, headers=API_parser.HEADERS, workers=workers,
+                             rate_limit=0, backoff=0.05) as fetcher:
+                API_parser.fetcher = fetcher
+                api.requests = 0
+                start = time.perf_counter()
+                places = API_parser.get_all_places()
+                events = API_parser.get_all_afisha_events(count_per_page=afisha_page_size)
+                mfc = API_parser.get_mfc_data()
+                duration = time.perf_counter() - start
+                print(f"workers={workers}, афиша по {afisha_page_size}: {duration:.2f} с, запросов {api.requests}, "
+                      f"мест {len(places)}, событий {len(events)}, МФЦ {len(mfc['data'])}")
@@ -0,0 +1,332 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+from datetime import datetime, timedelta
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_chroma import Chroma
+from embedding_pipeline import embed_documents, clear_checkpoints
+from corpus import read_source, record_text, corpus_file
+from dotenv import load_dotenv
+load_dotenv()
+
+FILE_LIST = ["all_parsed_data.txt", "afisha_events.txt", "beautiful_places.txt", "mfc_info.txt"]
+PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "data/chroma_db")
+MANIFEST_NAME = "manifest.json"
+CHECKPOINT_DIR = "embedding_checkpoints"
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 250
+METADATA_VERSION = 3  # увеличивается при изменении состава метаданных фрагментов
+NEVER_EXPIRES = 4102444800  # 2100-01-01: expires_ts записей без дат окончания
+# Поля записей корпуса, которые попадают в метаданные фрагментов (для фильтров в Chroma)
+METADATA_FIELDS = {
+    "Название": "title", "Категория": "category", "Категории": "category",
+    "Ближайшее метро": "metro", "Район": "district",
+}
+
+
+def file_hash(path):
+    """Считает sha256 файла, не читая его в память целиком"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_manifest(file_list=FILE_LIST):
+    """Описание исходных данных, из которых построен индекс"""
+    return {
+        "sources": {file_name: file_hash(corpus_file(file_name)) for file_name in file_list},
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "metadata_version": METADATA_VERSION,
+    }
+
+
+def read_manifest(persist_dir=PERSIST_DIR):
+    path = os.path.join(persist_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Не удалось прочитать манифест {path} - {e}")
+        return None
+
+
+def write_manifest(manifest, persist_dir=PERSIST_DIR):
+    os.makedirs(persist_dir, exist_ok=True)
+    path = os.path.join(persist_dir, MANIFEST_NAME)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def index_version(persist_dir=PERSIST_DIR):
+    """Короткий отпечаток текущего состояния базы (меняется после каждого обновления)"""
+    manifest = read_manifest(persist_dir) or {}
+    raw = json.dumps(manifest, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def chunk_id(source, entry_id, chunk, text):
+    """Стабильный идентификатор фрагмента для векторной базы"""
+    raw = f"{source}\x00{entry_id}\x00{chunk}\x00{text}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def parse_entry_date(text, field):
+    """Значение поля «Дата начала/окончания: YYYY-MM-DD HH:MM» записи афиши в виде datetime"""
+    match = re.search(rf"{field}:\s*(\d{{4}}-\d{{2}}-\d{{2}})(?: (\d{{2}}:\d{{2}}))?", text)
+    if match is None:
+        return None
+    day, hour = match.groups()
+    if hour is None:
+        return datetime.strptime(day, "%Y-%m-%d")
+    return datetime.strptime(f"{day} {hour}", "%Y-%m-%d %H:%M")
+
+
+def entry_dates(text):
+    """
+    Метаданные времени записи (unix-время): start_ts — начало события, expires_ts — момент,
+    после которого запись устаревает. У записей без дат expires_ts = NEVER_EXPIRES
+    """
+    start = parse_entry_date(text, "Дата начала")
+    end = parse_entry_date(text, "Дата окончания")
+    if end is not None and end.hour == 0 and end.minute == 0:
+        end += timedelta(days=1)  # дата без времени — событие идёт весь день
+    end = end or start
+
+    metadata = {"expires_ts": int(end.timestamp()) if end is not None else NEVER_EXPIRES}
+    if start is not None:
+        metadata["start_ts"] = int(start.timestamp())
+    return metadata
+
+
+def is_active(metadata, now=None):
+    """Не закончилось ли событие, к которому относится фрагмент"""
+    now = time.time() if now is None else now
+    return (metadata or {}).get("expires_ts", NEVER_EXPIRES) >= now
+
+
+def active_filter(now=None):
+    """Фильтр Chroma: только фрагменты, которые ещё не устарели"""
+    now = time.time() if now is None else now
+    return {"expires_ts": {"$gte": int(now)}}
+
+
+def record_metadata(fields):
+    """Метаданные фрагмента из полей записи корпуса"""
+    metadata = {}
+    for field, name in METADATA_FIELDS.items():
+        value = fields.get(field)
+        if value and value != "Не указано":
+            metadata[name] = str(value)[:200]
+    return metadata
+
+
+def load_documents(file_list=FILE_LIST):
+    """Записи корпуса (см. corpus) по одной, в виде документов с метаданными"""
+    for source in file_list:
+        for record in read_source(source):
+            text = record_text(record["fields"])
+            if not text:
+                continue
+            yield Document(
+                page_content=text,
+                metadata={
+                    "source": source,
+                    "entry_id": record["id"],
+                    **record_metadata(record["fields"]),
+                    **entry_dates(text)
+                }
+            )
+
+
+def split_documents(docs):
+    """Разбивает записи на фрагменты для векторной базы"""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+
+    for doc in docs:
+        text = doc.page_content
+        source = doc.metadata["source"]
+        entry_id = doc.metadata["entry_id"]
+        chunks = splitter.split_text(text)
+        for i, chunk in enumerate(chunks):
+            yield Document(
+                id=chunk_id(source, entry_id, i, chunk),
+                page_content=chunk,
+                metadata={**doc.metadata, "chunk": i}
+            )
+
+
+def active_chunks(file_list, now):
+    for doc in split_documents(load_documents(file_list)):
+        if is_active(doc.metadata, now):
+            yield doc
+
+
+def sync_index(vectorstore, file_list=FILE_LIST, persist_dir=PERSIST_DIR, batch_size=500):
+    """
+    Приводит векторную базу в соответствие с файлами данных: эмбеддинги считаются
+    только для новых или изменившихся фрагментов, устаревшие фрагменты удаляются.
+    Эмбеддинги считаются пачками параллельно (см. embedding_pipeline), прерванное
+    обновление продолжается с места остановки. Уже закончившиеся события в базу
+    не попадают. Корпус читается дважды потоком, в памяти держатся только id
+    и метаданные фрагментов. Возвращает отчёт о том, что изменилось.
+    """
+    now = time.time()
+    wanted = {doc.id: doc.metadata for doc in active_chunks(file_list, now)}
+
+    stored = vectorstore.get(include=["metadatas"])
+    stored_metadata = {doc_id: metadata or {} for doc_id, metadata in zip(stored["ids"], stored["metadatas"])}
+    existing = {doc_id: metadata.get("source", "неизвестно") for doc_id, metadata in stored_metadata.items()}
+
+    new_ids = {doc_id for doc_id in wanted if doc_id not in existing}
+    stale_ids = [doc_id for doc_id in existing if doc_id not in wanted]
+    # Тот же текст, но другие метаданные (например, после добавления дат) — эмбеддинг не пересчитывается
+    retagged = [doc_id for doc_id, metadata in wanted.items() if doc_id in existing and stored_metadata[doc_id] != metadata]
+
+    report = {
+        "added": {}, "removed": {}, "updated": len(retagged),
+        "unchanged": len(wanted) - len(new_ids) - len(retagged)
+    }
+    for doc_id in new_ids:
+        source = wanted[doc_id]["source"]
+        report["added"][source] = report["added"].get(source, 0) + 1
+    for doc_id in stale_ids:
+        source = existing[doc_id]
+        report["removed"][source] = report["removed"].get(source, 0) + 1
+
+    for i in range(0, len(stale_ids), batch_size):
+        vectorstore.delete(ids=stale_ids[i:i + batch_size])
+    for i in range(0, len(retagged), batch_size):
+        batch = retagged[i:i + batch_size]
+        vectorstore._collection.update(ids=batch, metadatas=[wanted[doc_id] for doc_id in batch])
+
+    def store_batch(batch, vectors):
+        vectorstore._collection.upsert(
+            ids=[doc.id for doc in batch],
+            embeddings=list(vectors),
+            metadatas=[doc.metadata for doc in batch],
+            documents=[doc.page_content for doc in batch]
+        )
+
+    checkpoint_dir = os.path.join(persist_dir, CHECKPOINT_DIR)
+    new_docs = (doc for doc in active_chunks(file_list, now) if doc.id in new_ids)
+    embed_documents(new_docs, vectorstore.embeddings, on_batch=store_batch, checkpoint_dir=checkpoint_dir)
+    clear_checkpoints(checkpoint_dir)
+
+    return report
+
+
+def compact_expired(vectorstore, now=None, batch_size=500):
+    """
+    Удаляет из векторной базы фрагменты закончившихся событий. Возвращает
+    число удалённых фрагментов по источникам
+    """
+    now = time.time() if now is None else now
+    expired = vectorstore.get(where={"expires_ts": {"$lt": int(now)}}, include=["metadatas"])
+    removed = {}
+    for metadata in expired["metadatas"]:
+        source = (metadata or {}).get("source", "неизвестно")
+        removed[source] = removed.get(source, 0) + 1
+    for i in range(0, len(expired["ids"]), batch_size):
+        vectorstore.delete(ids=expired["ids"][i:i + batch_size])
+    return removed
+
+
+def print_report(report):
+    print(f"Без изменений: {report['unchanged']} фрагментов")
+    if report.get("updated"):
+        print(f"Обновлены метаданные: {report['updated']} фрагментов")
+    for source, count in report["added"].items():
+        print(f"Добавлено из {source}: {count}")
+    for source, count in report["removed"].items():
+        print(f"Удалено из {source}: {count}")
+
+
+def open_vectorstore(embeddings, file_list=FILE_LIST, persist_dir=PERSIST_DIR, force_sync=False):
+    """
+    Открывает векторную базу. Файлы с данными разбираются и режутся на фрагменты
+    только если базы ещё нет или исходные файлы изменились с момента её построения,
+    и тогда база обновляется инкрементально (см. sync_index).
+    """
+    manifest = build_manifest(file_list)
+    exists = os.path.exists(persist_dir)
+
+    vectorstore = Chroma(
+        persist_directory=persist_dir,
+        embedding_function=embeddings
+    )
+
+    if exists and not force_sync:
+        saved_manifest = read_manifest(persist_dir)
+
+        if saved_manifest is None:
+            # База, построенная до появления манифеста, может быть пустой или без метаданных
+            # (expires_ts, source), без которых фильтр поиска её фрагменты не находит.
+            # Если id фрагментов совпадают, sync_index только обновит метаданные; базу
+            # исходной версии (случайные id, другой текст фрагментов) пришлось бы целиком
+            # пересчитать через платный API — это делается отдельно, не при запуске бота
+            print("Найдена существующая база Chroma без манифеста — проверка фрагментов...")
+            if vectorstore._collection.count() > 0:
+                stored_ids = set(vectorstore.get(include=[])["ids"])
+                missing = sum(1 for doc in active_chunks(file_list, time.time()) if doc.id not in stored_ids)
+                if missing:
+                    raise RuntimeError(
+                        f"База {persist_dir} построена прежней версией: {missing} фрагментов нужно "
+                        f"пересчитать через API эмбеддингов. Остановите бота и обновите базу: "
+                        f"python knowledge_base.py"
+                    )
+        elif saved_manifest == manifest and vectorstore._collection.count() > 0:
+            print("Найдена существующая база Chroma")
+            print("База загружена")
+            return vectorstore
+        elif saved_manifest == manifest:
+            print("База Chroma пуста — создание...")
+        else:
+            print("Исходные данные изменились — обновление базы...")
+    elif exists:
+        print("Обновление базы...")
+    else:
+        print("База не найдена — создание...")
+
+    # Незавершённое обновление не должно выглядеть актуальной базой при следующем запуске
+    write_manifest({"building": True}, persist_dir)
+    report = sync_index(vectorstore, file_list, persist_dir)
+    print_report(report)
+    write_manifest(manifest, persist_dir)
+    print("База обновлена")
+    return vectorstore
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["compact"]:
+        # Удаление закончившихся событий: python knowledge_base.py compact. Только при
+        # остановленном боте — Chroma (PersistentClient) нельзя менять из второго процесса,
+        # пока база открыта ботом; работающий бот чистит базу сам (bot.compaction_loop,
+        # webhook.py --compact перед запуском воркеров)
+        removed = compact_expired(Chroma(persist_directory=PERSIST_DIR))
+        print(f"Удалено устаревших фрагментов: {sum(removed.values())}")
+        sys.exit(0)
+
+    # Обновление базы после запуска парсеров (и перевод базы прежней версии) при
+    # остановленном боте: python knowledge_base.py
+    from langchain_gigachat import GigaChatEmbeddings
+
+    open_vectorstore(
+        GigaChatEmbeddings(
+            credentials=os.getenv("GIGACHAT_EMBEDDINGS_KEY"),
+            verify_ssl_certs=False
+        ),
+        force_sync=True
+    )
@@ -0,0 +1,150 @@
+import os
+import re
+import math
+import pickle
+import numpy as np
+from langchain_core.documents import Document
+from dotenv import load_dotenv
+load_dotenv()
+
+LEXICAL_INDEX_NAME = "lexical_index.pkl"
+STEM_LENGTH = 6  # грубый стемминг: слово обрезается до первых STEM_LENGTH букв
+RRF_K = 60  # константа Reciprocal Rank Fusion
+LEXICAL_RARE_IDF = float(os.getenv("LEXICAL_RARE_IDF", "4.0"))
+
+STOP_WORDS = {
+    "как", "где", "что", "это", "для", "при", "или", "если", "когда", "какие", "какой",
+    "какая", "можно", "нужно", "мне", "меня", "есть", "про", "расскажи", "подскажи",
+    "пожалуйста", "санкт", "петербург", "петербурге", "спб", "который", "которые",
+}
+
+
+def tokenize(text):
+    """Слова текста в нижнем регистре, без стоп-слов, обрезанные до основы"""
+    tokens = []
+    for word in re.findall(r"\w+", text.lower().replace("ё", "е")):
+        if len(word) < 3 and not word.isdigit():
+            continue
+        if word in STOP_WORDS:
+            continue
+        tokens.append(word[:STEM_LENGTH])
+    return tokens
+
+
+class BM25Index:
+    """
+    Компактный обратный индекс BM25 по тем же фрагментам, что и в Chroma.
+    Хранит тексты и метаданные фрагментов, поэтому найденные документы
+    возвращаются без обращения к векторной базе.
+    """
+
+    def __init__(self, ids, texts, metadatas, version=None, k1=1.5, b=0.75):
+        self.ids = list(ids)
+        self.texts = list(texts)
+        self.metadatas = list(metadatas)
+        self.version = version
+        self.k1 = k1
+        self.b = b
+
+        postings = {}
+        lengths = np.zeros(len(self.texts), dtype=np.float32)
+        for doc_index, text in enumerate(self.texts):
+            tokens = tokenize(text)
+            lengths[doc_index] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, ([], []))
+                postings[token][0].append(doc_index)
+                postings[token][1].append(count)
+
+        n_docs = max(1, len(self.texts))
+        self.avg_length = float(lengths.mean()) if len(self.texts) else 1.0
+        self.norm = (self.k1 * (1 - self.b + self.b * lengths / max(self.avg_length, 1.0))).astype(np.float32)
+        self.postings = {}
+        self.idf = {}
+        for token, (doc_indexes, counts) in postings.items():
+            self.postings[token] = (np.array(doc_indexes, dtype=np.int32), np.array(counts, dtype=np.float32))
+            df = len(doc_indexes)
+            self.idf[token] = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=20):
+        """Возвращает [(номер фрагмента, оценка, сколько слов запроса в нём есть)] по убыванию оценки"""
+        terms = [term for term in query_terms(query) if term in self.postings]
+        if not terms:
+            return []
+
+        scores = np.zeros(len(self.texts), dtype=np.float32)
+        matched = np.zeros(len(self.texts), dtype=np.int16)
+        for term in terms:
+            doc_indexes, tf = self.postings[term]
+            scores[doc_indexes] += self.idf[term] * tf * (self.k1 + 1) / (tf + self.norm[doc_indexes])
+            matched[doc_indexes] += 1
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i]), int(matched[i])) for i in top]
+
+    def has_rare_term(self, query):
+        """Есть ли в запросе редкое слово — название, станция метро, район и т.п."""
+        return any(self.idf.get(term, 0.0) >= LEXICAL_RARE_IDF for term in tokenize(query))
+
+    def document(self, doc_index):
+        return Document(
+            id=self.ids[doc_index],
+            page_content=self.texts[doc_index],
+            metadata=self.metadatas[doc_index]
+        )
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def query_terms(query):
+    """Различные слова запроса в порядке появления"""
+    return list(dict.fromkeys(tokenize(query)))
+
+
+def open_lexical_index(vectorstore, persist_dir, version):
+    """Загружает индекс BM25 рядом с базой Chroma или строит его заново по фрагментам из Chroma"""
+    path = os.path.join(persist_dir, LEXICAL_INDEX_NAME)
+    if os.path.exists(path):
+        try:
+            index = BM25Index.load(path)
+            if index.version == version:
+                print("Лексический индекс загружен")
+                return index
+        except Exception as e:
+            print(f"Не удалось прочитать лексический индекс - {e}")
+
+    print("Построение лексического индекса...")
+    stored = vectorstore.get(include=["documents", "metadatas"])
+    index = BM25Index(stored["ids"], stored["documents"], stored["metadatas"], version=version)
+    index.save(path)
+    print(f"Лексический индекс построен: {len(index.ids)} фрагментов, {len(index.postings)} терминов")
+    return index
+
+
+def reciprocal_rank_fusion(rankings, k):
+    """Объединяет несколько ранжированных списков документов (RRF)"""
+    scores = {}
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+            docs.setdefault(key, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ordered[:k]]
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from functools import wraps
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+load_dotenv()
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — HTTP-эндпоинт /metrics выключен
+METRICS_LOG = os.getenv("METRICS_LOG", "1") == "1"  # JSON-строка в лог на каждый запрос
+PREFIX = "city_agent_"
+
+_lock = threading.Lock()
+_counters = {}  # (имя, метки) -> значение
+_summaries = {}  # (имя, метки) -> [количество, сумма]
+_gauges = {}  # префикс -> функция, возвращающая словарь значений
+_current_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    with _lock:
+        summary = _summaries.setdefault(_key(name, labels), [0, 0.0])
+        summary[0] += 1
+        summary[1] += value
+
+
+def register_gauges(prefix, func):
+    """func() возвращает словарь числовых показателей, например answer_cache.metrics"""
+    _gauges[prefix] = func
+
+
+def trace_add(field, value=1):
+    """Добавляет значение к показателю текущего запроса (если запрос трассируется)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        with _lock:
+            trace[field] = trace.get(field, 0) + value
+
+
+def _trace_node(name, seconds):
+    trace = _current_trace.get()
+    if trace is not None:
+        with _lock:
+            trace["steps"][name] = round(trace["steps"].get(name, 0.0) + seconds, 4)
+
+
+@contextmanager
+def request_trace(**fields):
+    """
+    Собирает показатели одного запроса: время по узлам графа, токены, число
+    найденных фрагментов и итераций. По завершении пишет их одной JSON-строкой
+    """
+    trace = {"steps": {}}
+    token = _current_trace.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace["total_seconds"] = round(time.perf_counter() - start, 4)
+        observe("request_seconds", trace["total_seconds"])
+        if METRICS_LOG:
+            print(json.dumps({"event": "agent_request", **fields, **trace}, ensure_ascii=False, default=str))
+
+
+def timed(name):
+    """Декоратор: время выполнения функции (узла графа, обращения к API) в метрики и трассу"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                observe("step_seconds", seconds, step=name)
+                _trace_node(name, seconds)
+        return wrapper
+    return decorator
+
+
+def record_llm_usage(message):
+    """Учитывает токены ответа LLM (usage_metadata langchain)"""
+    usage = getattr(message, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens", 0)
+    completion_tokens = usage.get("output_tokens", 0)
+    inc("prompt_tokens_total", prompt_tokens)
+    inc("completion_tokens_total", completion_tokens)
+    inc("llm_calls_total")
+    trace_add("prompt_tokens", prompt_tokens)
+    trace_add("completion_tokens", completion_tokens)
+    trace_add("llm_calls")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def render_prometheus():
+    """Текущие метрики в текстовом формате Prometheus"""
+    lines = []
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+        for (name, labels), (count, total) in sorted(_summaries.items()):
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {count}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {total:.6f}")
+    for prefix, func in list(_gauges.items()):
+        try:
+            values = func()
+        except Exception as e:
+            print(f"Ошибка метрик {prefix}: {e}")
+            continue
+        for name, value in values.items():
+            if isinstance(value, (int, float)):
+                lines.append(f"{PREFIX}{prefix}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Поднимает HTTP-эндпоинт /metrics в фоновом потоке (если задан порт)"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Метрики доступны на :{port}/metrics")
+    return server
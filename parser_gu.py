@@ -1,6 +1,17 @@
+import re
+import time
 import requests
 from bs4 import BeautifulSoup
-import re
+from http_fetcher import HttpFetcher, HttpCache
+from corpus import CorpusWriter
+
+try:
+    import lxml  # noqa: F401 — быстрый разборщик HTML, если установлен
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+BASE_URL = "https://gu.spb.ru/knowledge-base/"
 
 def clean_text(text):
     """Очищает текст от лишних пробелов, табуляций и переносов строк"""
@@ -9,108 +20,137 @@ def clean_text(text):
     cleaned = re.sub(r'\s+', ' ', text)
     return cleaned.strip()
 
-def save_to_text_file(results, filename):
-    """Сохраняет результаты в текстовый файл"""
-    with open(filename, 'w', encoding='utf-8') as f:
-        for i, result in enumerate(results, 1):
-            f.write(f"=== Запись {i} ===\n")
-            f.write(f"Название: {result['Название']}\n")
-            f.write(f"Описание: {result['Описание']}\n")
-            f.write(f"Основная часть: {result['Основная_часть']}\n")
-            f.write(f"URL: {result['URL']}\n")
-            f.write("\n")
-
-def parse_all_themes():
-    """Парсит все темы из файла themes.txt"""
-    
+def parse_page(content, url):
+    """Разбирает страницу темы базы знаний (один проход разборщика)"""
+    soup = BeautifulSoup(content, HTML_PARSER)
+
+    section_tag = soup.find('section', class_='line-leading')
+
+    title = "Не найдено"
+    description = "Не найдено"
+
+    if section_tag:
+        heading_tag = section_tag.find(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+        if heading_tag:
+            title = clean_text(heading_tag.get_text())
+
+        paragraphs = section_tag.find_all('p')
+        if paragraphs:
+            description_texts = []
+            for p in paragraphs:
+                text = clean_text(p.get_text())
+                if text and text != title:
+                    description_texts.append(text)
+            description = ' '.join(description_texts)
+
+    main_content = "Не найдено"
+    main_tag = soup.find('main', class_='line-primary line-adaptive_540-leading')
+    if main_tag:
+        # Дерево страницы больше не нужно, поэтому ссылки заменяются прямо в нём, без копии
+        for link in main_tag.find_all('a'):
+            link_text = clean_text(link.get_text())
+            link_url = link.get('href', '')
+
+            if link_url.startswith('/'):
+                link_url = 'https://gu.spb.ru' + link_url
+
+            if link_text and link_url:
+                link.replace_with(f"{link_text} ({link_url})")
+            elif link_text:
+                link.replace_with(link_text)
+
+        main_text = main_tag.get_text(separator=' ')
+        main_content = clean_text(main_text)
+
+    return {
+        'Название': title,
+        'Описание': description,
+        'Основная часть': main_content,
+        'URL': url
+    }
+
+def parse_theme(theme, fetcher, cache):
+    """
+    Загружает и разбирает одну тему. Возвращает запись и признак того, что страница
+    не изменилась с прошлого запуска (ответ 304, запись взята из кэша). Если страницу
+    не удалось загрузить или разобрать, возвращается её прежняя запись из кэша
+    """
+    url = BASE_URL + theme + '/'
+    cached = cache.get(url)
+    try:
+        response = fetcher.get(url, headers=cache.conditional_headers(cached))
+        if response.status_code == 304 and cached:
+            return cached["data"], True
+        result = parse_page(response.content, url)
+        cache.put(url, response, result)
+        return result, False
+
+    except requests.RequestException as e:
+        print(f"Ошибка загрузки {theme}: {e}")
+        if cached:
+            print(f"{theme}: используется сохранённая копия страницы")
+            return cached["data"], False
+        return {
+            'Название': f"Ошибка: {theme}",
+            'Описание': "Не удалось загрузить страницу",
+            'Основная часть': "Не удалось загрузить страницу",
+            'URL': url
+        }, False
+    except Exception as e:
+        print(f"Ошибка парсинга {theme}: {e}")
+        if cached:
+            print(f"{theme}: используется сохранённая копия страницы")
+            return cached["data"], False
+        return {
+            'Название': f"Ошибка парсинга: {theme}",
+            'Описание': "Ошибка при обработке страницы",
+            'Основная часть': "Ошибка при обработке страницы",
+            'URL': url
+        }, False
+
+def parse_all_themes(themes_file='themes.txt', source='all_parsed_data.txt', fetcher=None, cache=None):
+    """
+    Парсит все темы из файла themes.txt в корпус (all_parsed_data.jsonl, см. corpus).
+    Страницы загружаются параллельно, неизменившиеся (по ETag/Last-Modified) не скачиваются
+    повторно, записи пишутся по мере готовности в порядке тем. Вместо страницы с ошибкой
+    берётся её копия из кэша; страницы с ошибками без копии в корпус не попадают.
+    Возвращает число успешно обработанных тем
+    """
+
     try:
-        with open('themes.txt', 'r', encoding='utf-8') as f:
+        with open(themes_file, 'r', encoding='utf-8') as f:
             themes = [line.strip() for line in f if line.strip()]
     except FileNotFoundError:
-        print("Файл themes.txt не найден!")
+        print(f"Файл {themes_file} не найден!")
         return
-    
-    print(f"Найдено {len(themes)} тем для парсинга")
-    
-    results = []
-    base_url = "https://gu.spb.ru/knowledge-base/"
-    
-    for i, theme in enumerate(themes, 1):
-        url = base_url + theme + '/'
-        try:
-            response = requests.get(url, timeout=20)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            section_tag = soup.find('section', class_='line-leading')
-            
-            title = "Не найдено"
-            description = "Не найдено"
-            
-            if section_tag:
-                heading_tag = section_tag.find(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-                if heading_tag:
-                    title = clean_text(heading_tag.get_text())
-                
-                paragraphs = section_tag.find_all('p')
-                if paragraphs:
-                    description_texts = []
-                    for p in paragraphs:
-                        text = clean_text(p.get_text())
-                        if text and text != title:  
-                            description_texts.append(text)
-                    description = ' '.join(description_texts)
-            
-            main_content = "Не найдено"
-            main_tag = soup.find('main', class_='line-primary line-adaptive_540-leading')
-            if main_tag:
-                main_copy = BeautifulSoup(str(main_tag), 'html.parser')
-                
-                for link in main_copy.find_all('a'):
-                    link_text = clean_text(link.get_text())
-                    link_url = link.get('href', '')
-                    
-                    if link_url.startswith('/'):
-                        link_url = 'https://gu.spb.ru' + link_url
-                    
-                    if link_text and link_url:
-                        link.replace_with(f"{link_text} ({link_url})")
-                    elif link_text:
-                        link.replace_with(link_text)
-                
-                main_text = main_copy.get_text(separator=' ')
-                main_content = clean_text(main_text)
-            
-            results.append({
-                'Название': title,
-                'Описание': description,
-                'Основная_часть': main_content,
-                'URL': url
-            })
-            
-            print(f"{i}/{len(themes)} Обработано: {theme}")
-            
-        except requests.RequestException as e:
-            print(f"Ошибка загрузки {theme}: {e}")
-            results.append({
-                'Название': f"Ошибка: {theme}",
-                'Описание': "Не удалось загрузить страницу",
-                'Основная_часть': "Не удалось загрузить страницу", 
-                'URL': url
-            })
-        except Exception as e:
-            print(f"Ошибка парсинга {theme}: {e}")
-            results.append({
-                'Название': f"Ошибка парсинга: {theme}",
-                'Описание': "Ошибка при обработке страницы",
-                'Основная_часть': "Ошибка при обработке страницы", 
-                'URL': url
-            })
-    
-    save_to_text_file(results, 'all_parsed_data.txt')
-    print(f"\nВсе данные сохранены в all_parsed_data.txt")
-    print(f"Успешно обработано: {len([r for r in results if 'Ошибка' not in r['Название']])} из {len(themes)}")
-    
-    return results
-
-results = parse_all_themes()
+
+    print(f"Найдено {len(themes)} тем для парсинга (разборщик HTML: {HTML_PARSER})")
+
+    own_fetcher = fetcher is None
+    fetcher = fetcher or HttpFetcher()
+    cache = cache or HttpCache()
+    start = time.perf_counter()
+    succeeded = unchanged = 0
+
+    # CorpusWriter пишет во временный файл: прерванный запуск не испортит прежние данные
+    try:
+        with CorpusWriter(source) as writer:
+            results = fetcher.imap(lambda theme: parse_theme(theme, fetcher, cache), themes)
+            for i, (theme, (result, not_modified)) in enumerate(zip(themes, results), 1):
+                if 'Ошибка' in result['Название']:
+                    continue
+                writer.write(result)
+                succeeded += 1
+                unchanged += not_modified
+                print(f"{i}/{len(themes)} {'Без изменений' if not_modified else 'Обработано'}: {theme}")
+    finally:
+        if own_fetcher:
+            fetcher.close()
+
+    print(f"\nВсе данные сохранены в {writer.path} за {time.perf_counter() - start:.1f} с")
+    print(f"Успешно обработано: {succeeded} из {len(themes)}, без изменений: {unchanged}")
+
+    return succeeded
+
+if __name__ == "__main__":
+    parse_all_themes()
@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import numpy as np
+from corpus import read_source, corpus_file
+from embedding_pipeline import batched, EMBED_BATCH_SIZE
+from knowledge_base import read_manifest, file_hash
+from vector_index import normalize_rows
+from dotenv import load_dotenv
+load_dotenv()
+
+# Дешёвая маршрутизация вопроса до вызова LLM: приветствия, благодарности и явно
+# посторонние вопросы получают готовый ответ, вопросы по темам базы знаний gu.spb.ru
+# сразу уходят в поиск — без первого вызова модели, который только выбрал бы retriever_tool.
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") == "1"
+# На сколько близость к посторонним темам должна превышать близость к темам бота
+ROUTER_OFFTOPIC_MARGIN = float(os.getenv("ROUTER_OFFTOPIC_MARGIN", "0.05"))
+# На сколько тема базы знаний должна быть ближе, чем МФЦ и афиша, чтобы сразу искать по базе
+ROUTER_RETRIEVAL_MARGIN = float(os.getenv("ROUTER_RETRIEVAL_MARGIN", "0.03"))
+ROUTER_VECTORS_NAME = "router_vectors.npz"
+
+ROUTE_ANSWER = "answer"  # готовый ответ без LLM
+ROUTE_RETRIEVAL = "retrieval"  # сразу поиск по базе знаний, затем LLM
+ROUTE_LLM = "llm"  # как раньше: инструмент выбирает модель
+
+GREETING = re.compile(
+    r"^(привет\w*|здравствуй\w*|добрый\s+(день|вечер)|доброе\s+утро|доброй\s+ночи|хай|hello|hi|салют)"
+    r"(,?\s+\w+)?[\s!.,)]*$", re.IGNORECASE
+)
+THANKS = re.compile(
+    r"^((большое|огромное)\s+)?(спасибо|благодарю|спс|сенкс)(\s+(большое|огромное|вам|тебе|за\s+помощь))*[\s!.,)]*$",
+    re.IGNORECASE
+)
+FAREWELL = re.compile(r"^(пока|до\s+свидания|всего\s+доброго|до\s+встречи)[\s!.,)]*$", re.IGNORECASE)
+
+GREETING_ANSWER = (
+    "Здравствуйте! Я помощник по государственным услугам и городской жизни Санкт-Петербурга. "
+    "Спросите, например, как получить документ, где ближайший МФЦ или куда сходить на выходных."
+)
+THANKS_ANSWER = "Пожалуйста! Если появятся ещё вопросы о городе и госуслугах — спрашивайте."
+FAREWELL_ANSWER = "Всего доброго! Обращайтесь, если понадобится помощь."
+OFFTOPIC_ANSWER = (
+    "Я агент-помощник в сфере государственных услуг и жизни в Санкт-Петербурге, "
+    "поэтому не могу ответить на этот вопрос. Спросите меня о госуслугах, МФЦ, "
+    "мероприятиях или интересных местах города."
+)
+
+# Вопросы, для которых у модели есть отдельные инструменты (mfc_lookup_tool, afisha_lookup_tool)
+# или которые требуют уточнения у пользователя: их оставляем модели
+TOOL_EXAMPLES = [
+    "Где ближайший МФЦ", "МФЦ у станции метро", "Часы работы МФЦ в районе", "Какой МФЦ работает в воскресенье",
+    "Какие мероприятия проходят в выходные", "Куда сходить сегодня вечером", "Афиша концертов и спектаклей",
+    "Выставки в Петербурге в этом месяце", "Красивые места для прогулки в Санкт-Петербурге",
+    "Что посмотреть в Петербурге",
+]
+OFFTOPIC_EXAMPLES = [
+    "Напиши стихотворение", "Расскажи анекдот", "Реши уравнение", "Напиши код на Python",
+    "Переведи текст на английский", "Какая погода в Москве", "Кто выиграл чемпионат мира по футболу",
+    "Посоветуй рецепт борща", "Какой курс биткоина", "Сколько будет дважды два",
+    "Кто ты по знаку зодиака", "Придумай название для компании",
+]
+
+
+def canned_answer(text):
+    """Готовый ответ на приветствие, благодарность или прощание, иначе None"""
+    text = " ".join(text.split())
+    if GREETING.match(text):
+        return GREETING_ANSWER
+    if THANKS.match(text):
+        return THANKS_ANSWER
+    if FAREWELL.match(text):
+        return FAREWELL_ANSWER
+    return None
+
+
+def theme_titles(themes_file="themes.txt", source="all_parsed_data.txt"):
+    """Названия тем базы знаний из themes.txt (по корпусу; если темы там нет — по адресу страницы)"""
+    try:
+        with open(themes_file, "r", encoding="utf-8") as f:
+            themes = [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+    titles = {}
+    try:
+        for record in read_source(source):
+            fields = record["fields"]
+            slug = fields.get("URL", "").rstrip("/").rsplit("/", 1)[-1]
+            if slug and fields.get("Название"):
+                titles[slug] = fields["Название"]
+    except FileNotFoundError:
+        pass
+    return [titles.get(theme, theme.replace("-", " ")) for theme in themes]
+
+
+class QueryRouter:
+    """
+    Сопоставляет эмбеддинг вопроса с категориями трёх групп: темы базы знаний
+    (themes.txt), вопросы для инструментов МФЦ и афиши, посторонние темы.
+    Оценка группы — близость к ближайшей категории группы. Векторы категорий
+    считаются один раз и хранятся рядом с векторной базой.
+    """
+
+    def __init__(self, embeddings, persist_dir, themes_file="themes.txt", source="all_parsed_data.txt",
+                 offtopic_margin=ROUTER_OFFTOPIC_MARGIN, retrieval_margin=ROUTER_RETRIEVAL_MARGIN):
+        self.embeddings = embeddings
+        self.persist_dir = persist_dir
+        self.path = os.path.join(persist_dir, ROUTER_VECTORS_NAME)
+        self.themes_file = themes_file
+        self.source = source
+        self.offtopic_margin = offtopic_margin
+        self.retrieval_margin = retrieval_margin
+        self.vectors = None
+        self.lock = threading.Lock()
+
+    def groups(self):
+        """Категории по группам. Названия тем читаются из корпуса — только при пересчёте векторов"""
+        groups = {
+            ROUTE_RETRIEVAL: theme_titles(self.themes_file, self.source),
+            ROUTE_LLM: TOOL_EXAMPLES,
+            "offtopic": OFFTOPIC_EXAMPLES,
+        }
+        return {group: texts for group, texts in groups.items() if texts}
+
+    def _texts_hash(self):
+        """Хэш набора категорий без чтения корпуса: themes.txt, хэш корпуса из манифеста базы и примеры"""
+        h = hashlib.sha256()
+        try:
+            with open(self.themes_file, "rb") as f:
+                h.update(f.read())
+        except FileNotFoundError:
+            pass
+        source_hash = ((read_manifest(self.persist_dir) or {}).get("sources") or {}).get(self.source)
+        if source_hash is None and os.path.exists(corpus_file(self.source)):
+            source_hash = file_hash(corpus_file(self.source))
+        h.update(str(source_hash).encode("utf-8"))
+        h.update(json.dumps([TOOL_EXAMPLES, OFFTOPIC_EXAMPLES], ensure_ascii=False).encode("utf-8"))
+        return h.hexdigest()
+
+    def _load_vectors(self):
+        """Векторы категорий: из файла, если набор категорий не менялся, иначе через API эмбеддингов"""
+        texts_hash = self._texts_hash()
+        try:
+            with np.load(self.path) as saved:
+                if str(saved["texts_hash"]) == texts_hash:
+                    return {group: saved[group] for group in saved.files if group != "texts_hash"}
+        except (OSError, KeyError, ValueError):
+            pass
+
+        vectors = {}
+        for group, texts in self.groups().items():
+            rows = []
+            for batch in batched(texts, EMBED_BATCH_SIZE):
+                rows.extend(self.embeddings.embed_documents(batch))
+            vectors[group] = normalize_rows(rows)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, texts_hash=texts_hash, **vectors)
+        os.replace(tmp_path, self.path)
+        return vectors
+
+    def load(self):
+        with self.lock:
+            if self.vectors is None:
+                self.vectors = self._load_vectors()
+        return self.vectors
+
+    def scores(self, query_vector):
+        """Близость вопроса к ближайшей категории каждой группы"""
+        self.load()
+        query = normalize_rows(query_vector)
+        return {group: float(np.max(matrix @ query)) for group, matrix in self.vectors.items()}
+
+    def classify(self, query_vector):
+        """ROUTE_ANSWER (посторонний вопрос), ROUTE_RETRIEVAL или ROUTE_LLM"""
+        scores = self.scores(query_vector)
+        on_topic = max(scores.get(ROUTE_RETRIEVAL, -1.0), scores.get(ROUTE_LLM, -1.0))
+        if scores.get("offtopic", -1.0) - on_topic >= self.offtopic_margin:
+            return ROUTE_ANSWER
+        if scores.get(ROUTE_RETRIEVAL, -1.0) - scores.get(ROUTE_LLM, -1.0) >= self.retrieval_margin:
+            return ROUTE_RETRIEVAL
+        return ROUTE_LLM
+
+    def route(self, text, embed_query, first_turn=True):
+        """
+        Возвращает (маршрут, готовый ответ или None). embed_query вызывается, только если
+        нужен эмбеддинг. Посторонние вопросы и прямой поиск определяются только для первого
+        вопроса диалога: уточнения вроде «а в субботу?» без контекста не классифицировать
+        """
+        answer = canned_answer(text)
+        if answer is not None:
+            return ROUTE_ANSWER, answer
+        if not first_turn:
+            return ROUTE_LLM, None
+        route = self.classify(embed_query(text))
+        return route, OFFTOPIC_ANSWER if route == ROUTE_ANSWER else None
@@ -0,0 +1,35 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    Потокобезопасный ограничитель частоты запросов («token bucket»):
+    в среднем не более rate запросов в секунду, всплесками до capacity.
+    rate <= 0 отключает ограничение.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1.0):
+        """Блокирует поток, пока не наберётся нужное количество токенов"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
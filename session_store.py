@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from dotenv import load_dotenv
+load_dotenv()
+
+# Путь к SQLite-базе диалогов; пустая строка — хранить только в памяти
+SESSION_DB = os.getenv("SESSION_DB", "data/sessions.sqlite3")
+SESSION_MEMORY_SIZE = int(os.getenv("SESSION_MEMORY_SIZE", "1000"))  # диалогов в памяти
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(24 * 3600)))  # секунд бездействия до удаления
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "40"))
+SESSION_MAX_CHARS = int(os.getenv("SESSION_MAX_CHARS", "50000"))
+
+
+def trim_messages(messages, max_messages=SESSION_MAX_MESSAGES, max_chars=SESSION_MAX_CHARS):
+    """
+    Оставляет последние обмены диалога (вопрос пользователя со всеми ответами модели
+    и инструментов) в пределах лимитов по количеству и объёму. Обмены не разрезаются,
+    последний сохраняется всегда: иначе следующий вопрос выглядел бы первым в диалоге
+    """
+    exchanges = []
+    for msg in messages:
+        if msg.type == "human" or not exchanges:
+            exchanges.append([])
+        exchanges[-1].append(msg)
+    # Сообщения до первого вопроса (ответы без вызвавшего их сообщения) не нужны
+    if len(exchanges) > 1 and exchanges[0][0].type != "human":
+        exchanges.pop(0)
+
+    kept, count, total = [], 0, 0
+    for exchange in reversed(exchanges):
+        size = sum(len(str(msg.content)) for msg in exchange)
+        if kept and (count + len(exchange) > max_messages or total + size > max_chars):
+            break
+        kept.append(exchange)
+        count += len(exchange)
+        total += size
+    return [msg for exchange in reversed(kept) for msg in exchange]
+
+
+class SessionStore:
+    """
+    Хранилище состояний диалогов (AgentState) пользователей: последние активные
+    диалоги лежат в памяти (LRU, не больше memory_size), все — в SQLite, поэтому
+    диалоги переживают перезапуск. Диалоги без активности дольше ttl удаляются,
+    размер каждого ограничивается trim_messages.
+    """
+
+    def __init__(self, db_path=SESSION_DB, memory_size=SESSION_MEMORY_SIZE, ttl=SESSION_TTL):
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.memory = OrderedDict()  # user_id -> (state, время последнего обращения)
+        self.lock = threading.Lock()
+        self.last_purge = 0.0
+        self.db = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "user_id INTEGER PRIMARY KEY, messages TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+            self.db.commit()
+
+    def _evict_idle(self, now):
+        while self.memory:
+            user_id, (_, updated) = next(iter(self.memory.items()))
+            if now - updated <= self.ttl:
+                break
+            del self.memory[user_id]
+        if self.db is not None and now - self.last_purge > 60:
+            self.db.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+            self.db.commit()
+            self.last_purge = now
+
+    def get(self, user_id):
+        """Возвращает состояние диалога пользователя (новое, если диалога нет)"""
+        now = time.time()
+        with self.lock:
+            self._evict_idle(now)
+            if user_id in self.memory:
+                state, _ = self.memory[user_id]
+            else:
+                state = {"messages": []}
+                if self.db is not None:
+                    row = self.db.execute(
+                        "SELECT messages FROM sessions WHERE user_id = ?", (user_id,)
+                    ).fetchone()
+                    if row is not None:
+                        state = {"messages": messages_from_dict(json.loads(row[0]))}
+            self._remember(user_id, state, now)
+            return state
+
+    def save(self, user_id, state):
+        """Сохраняет состояние после обработки сообщения, обрезая его до лимитов"""
+        now = time.time()
+        state["messages"] = trim_messages(state["messages"])
+        with self.lock:
+            self._remember(user_id, state, now)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO sessions (user_id, messages, updated) VALUES (?, ?, ?)",
+                    (user_id, json.dumps(messages_to_dict(state["messages"]), ensure_ascii=False), now)
+                )
+                self.db.commit()
+
+    def delete(self, user_id):
+        with self.lock:
+            self.memory.pop(user_id, None)
+            if self.db is not None:
+                self.db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+                self.db.commit()
+
+    def _remember(self, user_id, state, now):
+        self.memory[user_id] = (state, now)
+        self.memory.move_to_end(user_id)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def metrics(self):
+        with self.lock:
+            stored = 0
+            if self.db is not None:
+                stored = self.db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return {"in_memory": len(self.memory), "stored": stored}
@@ -0,0 +1,318 @@
+import os
+import re
+import sqlite3
+from datetime import datetime, timedelta
+from corpus import read_source
+from dotenv import load_dotenv
+load_dotenv()
+
+STRUCTURED_DB = os.getenv("STRUCTURED_DB", "data/city_data.sqlite3")
+
+WEEKDAY_STEMS = ["понед", "вторн", "сред", "четв", "пятн", "субб", "воскр"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mfc (
+    id INTEGER PRIMARY KEY,
+    name TEXT, address TEXT, working_hours TEXT, accessible_env TEXT,
+    link TEXT, nearest_metro TEXT, phone TEXT,
+    district_key TEXT, address_key TEXT,
+    open_days INTEGER  -- битовая маска дней работы, бит 0 — понедельник
+);
+CREATE INDEX IF NOT EXISTS mfc_district ON mfc (district_key);
+CREATE INDEX IF NOT EXISTS mfc_address ON mfc (address_key);
+
+-- По строке на каждую станцию из «Ближайшее метро» («Ломоносовская, Пролетарская» — две строки)
+CREATE TABLE IF NOT EXISTS mfc_station (
+    mfc_id INTEGER, station_key TEXT
+);
+CREATE INDEX IF NOT EXISTS mfc_station_key ON mfc_station (station_key, mfc_id);
+
+CREATE TABLE IF NOT EXISTS afisha (
+    id INTEGER PRIMARY KEY,
+    title TEXT, description TEXT,
+    start_date TEXT, end_date TEXT,  -- 'YYYY-MM-DD HH:MM'
+    age TEXT, categories TEXT, location_title TEXT, address TEXT,
+    title_key TEXT  -- название в нижнем регистре: lower() SQLite не понимает кириллицу
+);
+CREATE INDEX IF NOT EXISTS afisha_start ON afisha (start_date);
+CREATE INDEX IF NOT EXISTS afisha_end ON afisha (end_date);
+
+CREATE TABLE IF NOT EXISTS afisha_category (
+    event_id INTEGER, category_key TEXT
+);
+CREATE INDEX IF NOT EXISTS afisha_category_key ON afisha_category (category_key, event_id);
+"""
+
+
+def normalize(text):
+    return " ".join(str(text or "").lower().replace("ё", "е").split())
+
+
+def word_key(text, length=6):
+    """Первые буквы слова — чтобы «Театр» и «Театры» совпадали"""
+    return normalize(text)[:length]
+
+
+def district_key(name):
+    """Название района без окончания: «Невский» и «Невского» совпадают, а «Красносельский» и «Красногвардейский» — нет"""
+    return re.sub(r"(ого|ому|ий|ый|ой|ом|ая)$", "", normalize(name).split(" ")[0])
+
+
+def mfc_district_key(name):
+    """Ключ района из названия МФЦ вида «МФЦ Невского района Сектор № 1»"""
+    district = re.search(r"МФЦ\s+(\S+)\s+района", name or "")
+    return district_key(district.group(1)) if district else ""
+
+
+def station_key(name):
+    """Полное название станции без приставок «метро», «м.», «ст. м.»"""
+    return re.sub(r"^(станция\s+метро|ст\.?\s*м\.|метро\s+|м\.)\s*", "", normalize(name))
+
+
+def station_keys(value):
+    """Ключи всех станций из строки вида «Ломоносовская, Пролетарская»"""
+    keys = [station_key(name) for name in re.split(r"[,;/]", str(value or ""))]
+    return [key for key in keys if key]
+
+
+def open_days(working_hours):
+    """Битовая маска дней недели из строки вида «Понедельник - четверг с 09.30 до 18.00, пятница ...»"""
+    text = normalize(working_hours)
+    if "ежедневно" in text or "без выходных" in text:
+        return 0b1111111
+    mask = 0
+    for start, end in re.findall(r"([а-я]+)\s*[-–—]\s*([а-я]+)", text):
+        first, last = weekday_index(start), weekday_index(end)
+        if first is not None and last is not None:
+            for day in range(first, last + 1):
+                mask |= 1 << day
+    for word in re.findall(r"[а-я]+", text):
+        day = weekday_index(word)
+        if day is not None:
+            mask |= 1 << day
+    return mask
+
+
+def weekday_index(word):
+    for i, stem in enumerate(WEEKDAY_STEMS):
+        if normalize(word).startswith(stem):
+            return i
+    return None
+
+
+def format_date(value):
+    """Дата из API ('2025-12-18T16:00:00Z') в вид 'YYYY-MM-DD HH:MM', как в afisha_events.txt"""
+    if not value or value == "Не указано":
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).strftime("%Y-%m-%d %H:%M")
+    except ValueError:
+        return str(value)
+
+
+def connect(path=STRUCTURED_DB):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    db = sqlite3.connect(path)
+    upgrade_schema(db)
+    return db
+
+
+def upgrade_schema(db):
+    """Создаёт таблицы и дополняет базу прежней версии ключами названий событий и станций метро"""
+    tables = {name for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "afisha" in tables and "title_key" not in {row[1] for row in db.execute("PRAGMA table_info(afisha)")}:
+        db.execute("ALTER TABLE afisha ADD COLUMN title_key TEXT")
+        db.executemany(
+            "UPDATE afisha SET title_key = ? WHERE id = ?",
+            [(normalize(title), event_id) for event_id, title in db.execute("SELECT id, title FROM afisha").fetchall()]
+        )
+    db.executescript(SCHEMA)
+    if "mfc" in tables and "mfc_station" not in tables:
+        mfc_rows = db.execute("SELECT id, name, nearest_metro FROM mfc").fetchall()
+        db.executemany(
+            "INSERT INTO mfc_station (mfc_id, station_key) VALUES (?, ?)",
+            [(mfc_id, key) for mfc_id, _, metro in mfc_rows for key in station_keys(metro)]
+        )
+        db.executemany(
+            "UPDATE mfc SET district_key = ? WHERE id = ?",
+            [(mfc_district_key(name), mfc_id) for mfc_id, name, _ in mfc_rows]
+        )
+    db.commit()
+
+
+def save_mfc_records(mfc_list, path=STRUCTURED_DB):
+    """Сохраняет список МФЦ в формате API (/mfc/all/) в SQLite, заменяя прежние записи"""
+    rows, stations = [], []
+    for mfc in mfc_list:
+        name = mfc.get("name", "")
+        accessible = mfc.get("accessible_env", [])
+        phone = mfc.get("phone", [])
+        rows.append((
+            name, mfc.get("address", ""), mfc.get("working_hours", ""),
+            ", ".join(accessible) if isinstance(accessible, list) else accessible,
+            mfc.get("link", ""), mfc.get("nearest_metro", ""),
+            ", ".join(phone) if isinstance(phone, list) else phone,
+            mfc_district_key(name), normalize(mfc.get("address", "")),
+            open_days(mfc.get("working_hours", "")),
+        ))
+        stations.append(station_keys(mfc.get("nearest_metro", "")))
+    with connect(path) as db:
+        db.execute("DELETE FROM mfc")
+        db.execute("DELETE FROM mfc_station")
+        for row, keys in zip(rows, stations):
+            cursor = db.execute(
+                "INSERT INTO mfc (name, address, working_hours, accessible_env, link, nearest_metro, phone, "
+                "district_key, address_key, open_days) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row
+            )
+            db.executemany(
+                "INSERT INTO mfc_station (mfc_id, station_key) VALUES (?, ?)",
+                [(cursor.lastrowid, key) for key in keys]
+            )
+    print(f"МФЦ в {path}: {len(rows)}")
+
+
+def save_afisha_records(events, path=STRUCTURED_DB):
+    """Сохраняет события афиши в формате API (/afisha/all/) в SQLite, заменяя прежние записи"""
+    with connect(path) as db:
+        db.execute("DELETE FROM afisha")
+        db.execute("DELETE FROM afisha_category")
+        for event_info in events:
+            place = event_info.get("place", {})
+            categories = place.get("categories", []) or []
+            cursor = db.execute(
+                "INSERT INTO afisha (title, description, start_date, end_date, age, categories, "
+                "location_title, address, title_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (place.get("title", ""), place.get("description", ""),
+                 format_date(place.get("start_date")), format_date(place.get("end_date")),
+                 str(place.get("age", "")), ", ".join(categories),
+                 place.get("location_title", ""), place.get("address", ""), normalize(place.get("title", "")))
+            )
+            db.executemany(
+                "INSERT INTO afisha_category (event_id, category_key) VALUES (?, ?)",
+                [(cursor.lastrowid, normalize(category)) for category in categories]
+            )
+    print(f"События афиши в {path}: {len(events)}")
+
+
+def import_from_corpus(mfc_source="mfc_info.txt", afisha_source="afisha_events.txt", path=STRUCTURED_DB):
+    """Заполняет базу по уже сохранённому корпусу (без обращения к API)"""
+    save_mfc_records([
+        {
+            "name": r.get("Название", ""), "address": r.get("Адрес", ""),
+            "working_hours": r.get("Время работы", ""), "accessible_env": r.get("Доступность", ""),
+            "link": r.get("Ссылка", ""), "nearest_metro": r.get("Ближайшее метро", ""),
+            "phone": r.get("Телефон", ""),
+        }
+        for r in (record["fields"] for record in read_source(mfc_source))
+    ], path)
+    save_afisha_records([
+        {"place": {
+            "title": r.get("Название", ""), "description": r.get("Описание", ""),
+            "start_date": r.get("Дата начала"), "end_date": r.get("Дата окончания"),
+            "age": r.get("Возрастное ограничение", ""),
+            "categories": [c.strip() for c in r.get("Категория", "").split(",") if c.strip() and c.strip() != "Не указано"],
+            "location_title": r.get("Название локации", ""), "address": r.get("Адрес", ""),
+        }}
+        for r in (record["fields"] for record in read_source(afisha_source))
+    ], path)
+
+
+def ensure_structured_db(path=STRUCTURED_DB):
+    if not os.path.exists(path):
+        print("Структурированная база не найдена — импорт из корпуса...")
+        import_from_corpus(path=path)
+    else:
+        connect(path).close()
+
+
+def find_mfc(metro="", district="", address="", day="", path=STRUCTURED_DB, limit=10):
+    """Ищет МФЦ по станции метро, району, части адреса и дню недели работы"""
+    conditions, params = [], []
+    if metro:
+        # Станции сравниваются целиком: по первым буквам «Проспект Ветеранов» совпал бы с «Проспект Славы»
+        keys = station_keys(metro)
+        conditions.append(f"id IN (SELECT mfc_id FROM mfc_station WHERE station_key IN ({', '.join('?' * len(keys))}))")
+        params.extend(keys)
+    if district:
+        conditions.append("district_key = ?")
+        params.append(district_key(district))
+    if address:
+        conditions.append("address_key LIKE ?")
+        params.append("%" + normalize(address) + "%")
+    if day:
+        day_index = weekday_index(day)
+        if day_index is None:
+            try:
+                day_index = datetime.strptime(day, "%Y-%m-%d").weekday()
+            except ValueError:
+                day_index = None
+        if day_index is not None:
+            conditions.append("(open_days & ?) != 0")
+            params.append(1 << day_index)
+
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    with sqlite3.connect(path) as db:
+        db.row_factory = sqlite3.Row
+        return [dict(row) for row in db.execute(f"SELECT * FROM mfc{where} LIMIT ?", params + [limit])]
+
+
+def find_events(date_from="", date_to="", category="", text="", path=STRUCTURED_DB, limit=15):
+    """Ищет события афиши, идущие в промежутке дат (YYYY-MM-DD), по категории и словам в названии"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    date_from = date_from or today
+    date_to = date_to or date_from
+    # end_date в базе хранится с временем, поэтому граница — начало следующего дня
+    try:
+        date_to_end = (datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    except ValueError:
+        date_to_end = date_to
+
+    conditions = ["start_date < ?", "COALESCE(end_date, start_date) >= ?"]
+    params = [date_to_end, date_from]
+    if category:
+        conditions.append("id IN (SELECT event_id FROM afisha_category WHERE category_key LIKE ?)")
+        params.append(word_key(category) + "%")
+    if text:
+        conditions.append("title_key LIKE ?")
+        params.append("%" + normalize(text) + "%")
+
+    with sqlite3.connect(path) as db:
+        db.row_factory = sqlite3.Row
+        return [dict(row) for row in db.execute(
+            f"SELECT * FROM afisha WHERE {' AND '.join(conditions)} ORDER BY start_date LIMIT ?",
+            params + [limit]
+        )]
+
+
+def purge_past_events(now=None, path=STRUCTURED_DB):
+    """Удаляет из базы закончившиеся события афиши, возвращает их число"""
+    now = now or datetime.now()
+    with connect(path) as db:
+        cursor = db.execute(
+            "DELETE FROM afisha WHERE COALESCE(end_date, start_date) < ?", (now.strftime("%Y-%m-%d %H:%M"),)
+        )
+        db.execute("DELETE FROM afisha_category WHERE event_id NOT IN (SELECT id FROM afisha)")
+        return cursor.rowcount
+
+
+def format_mfc(rows):
+    return "\n\n".join(
+        f"Название: {r['name']}\nАдрес: {r['address']}\nВремя работы: {r['working_hours']}\n"
+        f"Ближайшее метро: {r['nearest_metro'] or 'Нет информации'}\nТелефон: {r['phone']}\nСсылка: {r['link']}"
+        for r in rows
+    )
+
+
+def format_events(rows):
+    return "\n\n".join(
+        f"Название: {r['title']}\nДата начала: {r['start_date']}\nДата окончания: {r['end_date']}\n"
+        f"Категория: {r['categories']}\nВозрастное ограничение: {r['age']}\n"
+        f"Место: {r['location_title']}, {r['address']}\nОписание: {(r['description'] or '').strip()[:300]}"
+        for r in rows
+    )
+
+
+if __name__ == "__main__":
+    # Заполнить базу по текущему корпусу: python structured_data.py
+    import_from_corpus()
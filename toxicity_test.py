@@ -1,21 +1,132 @@
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch
-import torch.nn.functional as F
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from dotenv import load_dotenv
+load_dotenv()
 
 
 MODEL_NAME = "cointegrated/rubert-tiny-toxicity"
+# torch — обычная модель fp32, int8 — динамическая int8-квантизация линейных слоёв,
+# onnx — ONNX Runtime на CPU (нужен пакет optimum[onnxruntime]),
+# fake — только проверка по корням слов, без модели (офлайн-замеры, см. benchmark.py)
+TOXICITY_BACKEND = os.getenv("TOXICITY_BACKEND", "torch")
+TOXICITY_BATCH_WINDOW = float(os.getenv("TOXICITY_BATCH_WINDOW", "0.01"))  # секунд
+TOXICITY_MAX_BATCH = int(os.getenv("TOXICITY_MAX_BATCH", "32"))
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
 toxic_roots = ["дура", "глуп", "неумн", "кончен", "дрян"]
+
+tokenizer = None
+model = None
+_load_lock = threading.Lock()
+
+
+def load_model(backend=TOXICITY_BACKEND):
+    """Загружает токенизатор и модель при первом обращении (torch импортируется здесь же)"""
+    global tokenizer, model
+    if backend == "fake":
+        return
+    with _load_lock:
+        if model is not None:
+            return
+        start = time.perf_counter()
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+        loaded_tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        if backend == "onnx":
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+            loaded_model = ORTModelForSequenceClassification.from_pretrained(MODEL_NAME, export=True)
+        else:
+            loaded_model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
+            loaded_model.eval()
+            if backend == "int8":
+                loaded_model = torch.quantization.quantize_dynamic(
+                    loaded_model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+        tokenizer = loaded_tokenizer
+        model = loaded_model
+        print(f"Модель токсичности ({backend}) загружена за {time.perf_counter() - start:.2f} секунд")
+
+
+def check_toxicity_batch(texts):
+    """Оценивает токсичность сразу нескольких сообщений за один прогон модели"""
+    if not texts:
+        return []
+    texts = [text.lower() for text in texts]
+
+    if TOXICITY_BACKEND == "fake":
+        toxic_probs = [0.0] * len(texts)
+    else:
+        load_model()
+        import torch
+        import torch.nn.functional as F
+
+        inputs = tokenizer(texts, return_tensors="pt", truncation=True, padding=True)
+        with torch.no_grad():
+            logits = model(**inputs).logits
+
+        toxic_probs = F.softmax(logits[:, :2], dim=1)[:, 1].tolist()
+
+    results = []
+    for text, toxic_prob in zip(texts, toxic_probs):
+        for toxic in toxic_roots:
+            if (toxic in text):
+                toxic_prob += 0.6
+        results.append({"toxic": f"{toxic_prob:.10f}"})
+    return results
+
+
+class ToxicityBatcher:
+    """
+    Собирает сообщения, пришедшие из разных потоков в течение window секунд
+    (но не больше max_batch), и оценивает их одним вызовом check_toxicity_batch
+    """
+
+    def __init__(self, window=TOXICITY_BATCH_WINDOW, max_batch=TOXICITY_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name="toxicity", daemon=True)
+                self.worker.start()
+
+    def submit(self, text):
+        self._ensure_worker()
+        future = Future()
+        self.requests.put((text, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                results = check_toxicity_batch([text for text, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+batcher = ToxicityBatcher()
+
+
 def check_toxicity(text):
-    text = text.lower()
-    inputs = tokenizer(text, return_tensors="pt", truncation=True)
-    with torch.no_grad():
-        logits = model(**inputs).logits
-
-    toxic_prob = F.softmax(logits[:, :2], dim=1)[0][1].item()
-    for toxic in toxic_roots:
-        if (toxic in text):
-            toxic_prob += 0.6
-    return {"toxic": f"{toxic_prob:.10f}"}
+    return batcher.submit(text).result()
@@ -0,0 +1,442 @@
+import os
+import json
+import time
+import uuid
+import threading
+import numpy as np
+from langchain_core.documents import Document
+from knowledge_base import NEVER_EXPIRES
+from dotenv import load_dotenv
+load_dotenv()
+
+try:
+    import fcntl  # блокировка выгрузки между процессами и контейнерами с общим томом
+except ImportError:
+    fcntl = None
+
+# Векторный поиск без Chroma: эмбеддинги фрагментов лежат в матрице .npy, которая
+# открывается через np.load(mmap_mode="r"). Страницы файла общие для всех процессов
+# (см. webhook.py), поэтому каждый воркер не держит свою копию индекса HNSW в памяти.
+# Chroma остаётся основной базой: индекс выгружается из неё после обновления,
+# как и лексический индекс (см. lexical_index.open_lexical_index).
+
+MMAP_INDEX_DIR = "mmap_index"
+MMAP_DTYPE = os.getenv("MMAP_DTYPE", "float32")  # float16 — вдвое меньше памяти, но полный перебор медленнее (лучше с IVF)
+# Число списков IVF: 0 — полный перебор, auto — IVF только для больших баз
+MMAP_IVF_LISTS = os.getenv("MMAP_IVF_LISTS", "auto")
+MMAP_IVF_MIN_ROWS = 50000  # до такого размера полный перебор быстрее IVF
+MMAP_IVF_PROBES = int(os.getenv("MMAP_IVF_PROBES", "16"))  # сколько ближайших списков просматривать
+EXPORT_BATCH_SIZE = 1000
+SCAN_BLOCK_ROWS = 16384  # строк float16 за раз переводятся во float32 при переборе
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def mmr_select(queries, candidates, valid, k, lambda_mult=0.5):
+    """
+    Maximal marginal relevance сразу для нескольких запросов по нормированным векторам.
+    candidates — кандидаты каждого запроса (запросы × кандидаты × размерность), valid —
+    какие из них настоящие (у запросов их может быть разное число). Близости считаются
+    умножением матриц, на каждом шаге для всех запросов обновляется только максимум
+    по выбранным. Возвращает для каждого запроса номера кандидатов в порядке выбора
+    """
+    n_queries, n_candidates = valid.shape
+    if n_queries == 0 or n_candidates == 0 or k <= 0:
+        return [[] for _ in range(n_queries)]
+    to_query = np.einsum("qfd,qd->qf", candidates, queries)
+    pairwise = candidates @ candidates.transpose(0, 2, 1)
+    rows = np.arange(n_queries)
+    available = valid.copy()
+
+    best = np.argmax(np.where(available, to_query, -np.inf), axis=1)
+    selected = [np.where(available[rows, best], best, -1)]
+    available[rows, best] = False
+    redundancy = pairwise[rows, best]
+    for _ in range(min(k, n_candidates) - 1):
+        scores = lambda_mult * to_query - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = np.argmax(scores, axis=1)
+        selected.append(np.where(available[rows, best], best, -1))
+        available[rows, best] = False
+        np.maximum(redundancy, pairwise[rows, best], out=redundancy)
+
+    selected = np.stack(selected, axis=1)
+    return [[int(i) for i in chosen if i >= 0] for chosen in selected]
+
+
+def train_ivf(vectors, n_lists, iterations=10, sample_size=100000, seed=0):
+    """Центроиды IVF сферическим k-means по выборке строк; возвращает (центроиды, номер списка каждой строки)"""
+    rng = np.random.default_rng(seed)
+    sample = vectors[np.sort(rng.choice(len(vectors), min(len(vectors), sample_size), replace=False))]
+    sample = np.asarray(sample, dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = np.bincount(assignment, minlength=n_lists) == 0
+        sums[empty] = centroids[empty]  # пустой список сохраняет прежний центр
+        centroids = normalize_rows(sums)
+
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SCAN_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+        assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return centroids, assignment
+
+
+def ivf_list_count(rows):
+    if MMAP_IVF_LISTS != "auto":
+        return int(MMAP_IVF_LISTS)
+    return int(np.sqrt(rows)) if rows >= MMAP_IVF_MIN_ROWS else 0
+
+
+def matches(value, condition):
+    """Условие фильтра Chroma для одного значения: {"$gte": x}, {"$in": [...]} или точное совпадение"""
+    if not isinstance(condition, dict):
+        return value == condition
+    operations = {
+        "$eq": lambda a, b: a == b, "$ne": lambda a, b: a != b,
+        "$gt": lambda a, b: a is not None and a > b, "$gte": lambda a, b: a is not None and a >= b,
+        "$lt": lambda a, b: a is not None and a < b, "$lte": lambda a, b: a is not None and a <= b,
+        "$in": lambda a, b: a in b, "$nin": lambda a, b: a not in b,
+    }
+    return all(operations[op](value, operand) for op, operand in condition.items())
+
+
+class MmapVectorStore:
+    """
+    Векторная база только для чтения поверх файлов в каталоге path:
+    vectors.npy (нормированные эмбеддинги), expires_ts.npy, records.jsonl с id, текстом
+    и метаданными фрагментов (offsets.npy — смещения строк), при необходимости
+    IVF-индекс (ivf_centroids.npy, ivf_order.npy, ivf_offsets.npy) и meta.json.
+    Поддерживает те методы Chroma, которыми пользуется агент.
+    """
+
+    def __init__(self, path, embeddings=None, probes=MMAP_IVF_PROBES):
+        self.path = path
+        self.embeddings = embeddings
+        self.probes = probes
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.vectors = self._load("vectors.npy")
+        # Числовые метаданные отдельными столбцами: фильтр по ним не читает records.jsonl
+        self.columns = {"expires_ts": self._load("expires_ts.npy")}
+        self.offsets = self._load("offsets.npy")
+        self.records = np.memmap(os.path.join(path, "records.jsonl"), dtype=np.uint8, mode="r") \
+            if self.offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+        self.ivf = None
+        if self.meta.get("ivf_lists"):
+            self.ivf = (self._load("ivf_centroids.npy"), self._load("ivf_order.npy"), self._load("ivf_offsets.npy"))
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name), mmap_mode="r")
+
+    @property
+    def version(self):
+        return self.meta.get("version")
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def record(self, row):
+        raw = bytes(self.records[self.offsets[row]:self.offsets[row + 1]])
+        return json.loads(raw.decode("utf-8"))
+
+    def document(self, row):
+        record = self.record(row)
+        return Document(id=record["id"], page_content=record["text"], metadata=record["metadata"])
+
+    def _filter_mask(self, where, rows):
+        """Какие из строк rows подходят под фильтр where (подмножество синтаксиса Chroma)"""
+        if not where:
+            return np.ones(len(rows), dtype=bool)
+        if "$and" in where:
+            mask = np.ones(len(rows), dtype=bool)
+            for part in where["$and"]:
+                mask &= self._filter_mask(part, rows)
+            return mask
+        if "$or" in where:
+            mask = np.zeros(len(rows), dtype=bool)
+            for part in where["$or"]:
+                mask |= self._filter_mask(part, rows)
+            return mask
+
+        mask = np.ones(len(rows), dtype=bool)
+        for field, condition in where.items():
+            if field in self.columns:
+                column = np.asarray(self.columns[field][rows])
+                if isinstance(condition, dict):
+                    for op, operand in condition.items():
+                        compare = {"$gte": np.greater_equal, "$gt": np.greater, "$lte": np.less_equal,
+                                   "$lt": np.less, "$eq": np.equal, "$ne": np.not_equal}[op]
+                        mask &= compare(column, operand)
+                else:
+                    mask &= column == condition
+            else:
+                # Остальные поля — по метаданным из records.jsonl (медленно, но редко нужно)
+                for i, row in enumerate(rows):
+                    if mask[i]:
+                        mask[i] = matches(self.record(row)["metadata"].get(field), condition)
+        return mask
+
+    def candidate_rows(self, queries):
+        """Строки, среди которых ищутся ближайшие: все или из ближайших к запросам списков IVF"""
+        if self.ivf is None:
+            return None
+        centroids, order, offsets = self.ivf
+        probes = min(self.probes, len(centroids))
+        nearest = np.argpartition(-(queries @ centroids.T), probes - 1, axis=1)[:, :probes]
+        return np.sort(np.concatenate([order[offsets[i]:offsets[i + 1]] for i in np.unique(nearest)]))
+
+    def scores(self, queries, rows=None):
+        """Косинусная близость строк rows (None — всех) к запросам: матрица строки × запросы"""
+        if len(self.vectors) == 0 or (rows is not None and len(rows) == 0):
+            return np.zeros((0, len(queries)), dtype=np.float32)
+        if rows is not None:
+            return np.asarray(self.vectors[rows], dtype=np.float32) @ queries.T
+        if self.vectors.dtype == np.float32:
+            return np.asarray(self.vectors @ queries.T)
+        result = np.empty((len(self.vectors), len(queries)), dtype=np.float32)
+        for start in range(0, len(self.vectors), SCAN_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+            result[start:start + len(block)] = block @ queries.T
+        return result
+
+    def top_rows(self, queries, n, filter=None):
+        """
+        n ближайших к каждому запросу строк, удовлетворяющих фильтру, по убыванию близости:
+        (номера строк, близости) — матрицы запросы × n. Все запросы — одним умножением матриц
+        """
+        rows = self.candidate_rows(queries)
+        scores = self.scores(queries, rows).T
+        if rows is None:
+            rows = np.arange(len(self.vectors))
+        if filter:
+            mask = self._filter_mask(filter, rows)
+            rows, scores = rows[mask], scores[:, mask]
+        n = min(n, len(rows))
+        if n == 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+        return rows[top], np.take_along_axis(scores, top, axis=1)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        rows, _ = self.top_rows(normalize_rows([embedding]), k, filter)
+        return [self.document(row) for row in rows[0]]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k, filter)
+
+    def max_marginal_relevance_search_batch_by_vector(self, embeddings, k=4, fetch_k=20, lambda_mult=0.5,
+                                                      filter=None):
+        """MMR-поиск для матрицы эмбеддингов запросов: список документов на каждый запрос"""
+        queries = normalize_rows(embeddings)
+        rows, _ = self.top_rows(queries, fetch_k, filter)
+        if rows.shape[1] == 0:
+            return [[] for _ in range(len(queries))]
+        candidates = np.asarray(self.vectors[rows.ravel()], dtype=np.float32)
+        candidates = candidates.reshape(rows.shape + (self.vectors.shape[1],))
+        selected = mmr_select(queries, candidates, np.ones(rows.shape, dtype=bool), k, lambda_mult)
+        return [[self.document(rows[q, i]) for i in chosen] for q, chosen in enumerate(selected)]
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5,
+                                                filter=None, **kwargs):
+        return self.max_marginal_relevance_search_batch_by_vector([embedding], k, fetch_k, lambda_mult, filter)[0]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self.embeddings.embed_query(query), k, fetch_k, lambda_mult, filter
+        )
+
+
+def chroma_mmr_search_batch(vectorstore, embeddings, k=4, fetch_k=20, lambda_mult=0.5, filter=None):
+    """То же для Chroma: все запросы — одним обращением к коллекции, MMR — как в MmapVectorStore"""
+    if len(embeddings) == 0:
+        return []
+    result = vectorstore._collection.query(
+        query_embeddings=np.asarray(embeddings, dtype=np.float32), n_results=fetch_k, where=filter or None,
+        include=["documents", "metadatas", "embeddings"]
+    )
+    n_candidates = max(len(ids) for ids in result["ids"])
+    dimension = len(embeddings[0])
+    candidates = np.zeros((len(embeddings), n_candidates, dimension), dtype=np.float32)
+    valid = np.zeros((len(embeddings), n_candidates), dtype=bool)
+    for q, vectors in enumerate(result["embeddings"]):
+        if len(vectors):
+            candidates[q, :len(vectors)] = normalize_rows(vectors)
+            valid[q, :len(vectors)] = True
+
+    selected = mmr_select(normalize_rows(embeddings), candidates, valid, k, lambda_mult)
+    return [
+        [Document(id=result["ids"][q][i], page_content=result["documents"][q][i],
+                  metadata=result["metadatas"][q][i] or {}) for i in chosen]
+        for q, chosen in enumerate(selected)
+    ]
+
+
+def mmr_search_batch(store, embeddings, k=4, fetch_k=20, lambda_mult=0.5, filter=None):
+    """MMR-поиск сразу для нескольких эмбеддингов запросов в MmapVectorStore или Chroma"""
+    if isinstance(store, MmapVectorStore):
+        return store.max_marginal_relevance_search_batch_by_vector(embeddings, k, fetch_k, lambda_mult, filter)
+    return chroma_mmr_search_batch(store, embeddings, k, fetch_k, lambda_mult, filter)
+
+
+def export_index(vectorstore, path, version, dtype=MMAP_DTYPE):
+    """
+    Выгружает фрагменты из Chroma в файлы MmapVectorStore пачками (вся база в память
+    не читается). Файлы пишутся под временными именами и заменяют прежние в конце,
+    meta.json — последним: уже открытые другими процессами файлы остаются целыми.
+    Временные имена свои у каждой выгрузки, поэтому одновременные выгрузки не портят друг другу файлы
+    """
+    os.makedirs(path, exist_ok=True)
+    collection = vectorstore._collection
+    count = collection.count()
+    suffix = f".{uuid.uuid4().hex}.tmp"
+
+    def tmp(name):
+        return os.path.join(path, name + suffix)
+
+    def save(name, array):
+        with open(tmp(name), "wb") as f:
+            np.save(f, array)
+
+    vectors = dimension = None
+    expires_ts = np.full(count, NEVER_EXPIRES, dtype=np.int64)
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    row = 0
+    with open(tmp("records.jsonl"), "wb") as records:
+        for offset in range(0, count, EXPORT_BATCH_SIZE):
+            batch = collection.get(limit=EXPORT_BATCH_SIZE, offset=offset,
+                                   include=["embeddings", "documents", "metadatas"])
+            if not batch["ids"]:
+                break
+            if vectors is None:
+                dimension = len(batch["embeddings"][0])
+                vectors = np.lib.format.open_memmap(tmp("vectors.npy"), mode="w+", dtype=dtype,
+                                                    shape=(count, dimension))
+            batch_vectors = normalize_rows(batch["embeddings"])
+            vectors[row:row + len(batch_vectors)] = batch_vectors.astype(dtype)
+            for doc_id, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                metadata = metadata or {}
+                expires_ts[row] = metadata.get("expires_ts", NEVER_EXPIRES)
+                line = json.dumps({"id": doc_id, "text": text, "metadata": metadata}, ensure_ascii=False)
+                records.write(line.encode("utf-8") + b"\n")
+                offsets[row + 1] = records.tell()
+                row += 1
+
+    if vectors is None:
+        # Пустая коллекция: размерность — из Chroma, если коллекция её уже знает
+        # (описание коллекции перечитывается: у открытого объекта оно может быть устаревшим)
+        model = vectorstore._client.get_collection(collection.name).get_model()
+        dimension = getattr(model, "dimension", None) or 0
+        save("vectors.npy", np.zeros((0, dimension), dtype=dtype))
+    else:
+        vectors.flush()
+        del vectors
+        if row < count:
+            # База уменьшилась во время выгрузки — лишние строки отбрасываются
+            trimmed = np.array(np.load(tmp("vectors.npy"), mmap_mode="r")[:row])
+            save("vectors.npy", trimmed)
+    vectors = np.load(tmp("vectors.npy"), mmap_mode="r")
+    files = {"expires_ts.npy": expires_ts[:row], "offsets.npy": offsets[:row + 1]}
+
+    n_lists = min(ivf_list_count(row), row)
+    if n_lists:
+        centroids, assignment = train_ivf(vectors, n_lists)
+        order = np.argsort(assignment, kind="stable").astype(np.int64)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+        files.update({"ivf_centroids.npy": centroids, "ivf_order.npy": order, "ivf_offsets.npy": list_offsets})
+
+    for name, array in files.items():
+        save(name, array)
+    for name in ["records.jsonl", "vectors.npy", *files]:
+        os.replace(tmp(name), os.path.join(path, name))
+
+    meta = {"version": version, "count": row, "dimension": dimension or 0, "dtype": dtype,
+            "ivf_lists": n_lists, "exported_at": int(time.time())}
+    with open(tmp("meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp("meta.json"), os.path.join(path, "meta.json"))
+    return meta
+
+
+_export_lock = threading.Lock()
+
+
+class _ExportFileLock:
+    """Блокировка файла рядом с индексом: выгрузку выполняет один процесс, остальные ждут"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def open_mmap_index(vectorstore, persist_dir, version):
+    """
+    Открывает MmapVectorStore рядом с базой Chroma или выгружает его заново, если версия другая.
+    Версия проверяется под блокировкой: процесс, дождавшийся чужой выгрузки, её не повторяет
+    """
+    path = os.path.join(persist_dir, MMAP_INDEX_DIR)
+    with _export_lock, _ExportFileLock(path + ".lock"):
+        try:
+            index = MmapVectorStore(path, vectorstore.embeddings)
+            if index.version == version:
+                print(f"Индекс mmap загружен: {len(index)} фрагментов")
+                return index
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(path):
+                print(f"Не удалось прочитать индекс mmap - {e}")
+
+        print("Выгрузка векторов из Chroma в индекс mmap...")
+        meta = export_index(vectorstore, path, version)
+        print(f"Индекс mmap построен: {meta['count']} фрагментов, списков IVF: {meta['ivf_lists']}")
+        return MmapVectorStore(path, vectorstore.embeddings)
+
+
+if __name__ == "__main__":
+    # Сравнение с Chroma на готовой базе: python vector_index.py [каталог базы Chroma]
+    import sys
+    import resource
+    from langchain_chroma import Chroma
+    from knowledge_base import PERSIST_DIR, index_version, active_filter
+
+    persist_dir = sys.argv[1] if len(sys.argv) > 1 else PERSIST_DIR
+    chroma = Chroma(persist_directory=persist_dir)
+    index = open_mmap_index(chroma, persist_dir, index_version(persist_dir))
+    rng = np.random.default_rng(0)
+    queries = normalize_rows(np.asarray(index.vectors[rng.choice(len(index), 200)], dtype=np.float32)
+                             + rng.normal(0, 0.02, (200, index.vectors.shape[1])))
+
+    for name, store in (("chroma", chroma), ("mmap", index)):
+        start = time.perf_counter()
+        results = [store.max_marginal_relevance_search_by_vector(query.tolist(), k=8, fetch_k=20,
+                                                                 lambda_mult=0.8, filter=active_filter(0))
+                   for query in queries]
+        duration = (time.perf_counter() - start) / len(queries) * 1000
+        print(f"{name}: {duration:.2f} мс на запрос, найдено {sum(map(len, results))}")
+
+        start = time.perf_counter()
+        batch = mmr_search_batch(store, queries, k=8, fetch_k=20, lambda_mult=0.8, filter=active_filter(0))
+        duration = (time.perf_counter() - start) / len(queries) * 1000
+        same = sum(len({d.id for d in a} & {d.id for d in b}) for a, b in zip(results, batch))
+        print(f"{name}, пакетом: {duration:.2f} мс на запрос, совпадает {same / max(1, sum(map(len, results))):.0%}")
+
+    print(f"Пиковый RSS процесса: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
@@ -0,0 +1,213 @@
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import multiprocessing
+import urllib.error
+import urllib.request
+from aiohttp import web, ClientSession, ClientError, ClientTimeout
+from aiogram import Bot
+from dotenv import load_dotenv
+load_dotenv()
+
+# Приём обновлений Telegram через webhook с несколькими воркерами (процессами или контейнерами).
+# Балансировщик отправляет все обновления одного пользователя одному и тому же воркеру:
+# так сохраняется порядок сообщений пользователя (см. agent_pool), а кэш диалогов
+# в памяти воркера (см. session_store) не расходится с другими воркерами.
+
+TG_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный https-адрес балансировщика
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # заголовок X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))
+# Адрес воркера в режиме --worker; 0.0.0.0 — только если порт воркера закрыт снаружи
+WORKER_HOST = os.getenv("WORKER_HOST", "127.0.0.1")
+# Уже запущенные воркеры (например, отдельные контейнеры «python webhook.py --worker»),
+# через запятую; если заданы, процессы воркеров здесь не запускаются, а базу перед их
+# запуском чистит отдельный шаг «python webhook.py --compact»
+WEBHOOK_WORKER_URLS = [url.strip().rstrip("/") for url in os.getenv("WEBHOOK_WORKER_URLS", "").split(",") if url.strip()]
+WORKER_START_TIMEOUT = float(os.getenv("WORKER_START_TIMEOUT", "3600"))  # первый запуск может строить индекс
+
+
+def update_user_id(update):
+    """id пользователя, от которого пришло обновление (или update_id, если пользователя нет)"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user") or value.get("chat")
+        if isinstance(user, dict) and "id" in user:
+            return int(user["id"])
+    return int(update.get("update_id", 0))
+
+
+def worker_for(user_id, worker_count):
+    return abs(user_id) % worker_count
+
+
+def run_worker(port, metrics_port):
+    """Процесс воркера: бот в режиме webhook (см. bot.serve_webhook)"""
+    import bot
+    asyncio.run(bot.serve_webhook("127.0.0.1", port, metrics_port))
+
+
+def compact_indexes():
+    """
+    Обновляет векторную базу и удаляет закончившиеся события до запуска воркеров.
+    Chroma (PersistentClient) нельзя менять из одного процесса, пока базу открыли другие,
+    поэтому воркеры сами её не чистят; закончившиеся события до следующего перезапуска
+    отсекаются фильтром по expires_ts при поиске
+    """
+    import agent
+    agent.compact_expired_events()
+
+
+def run_compaction():
+    """Запускает compact_indexes отдельным процессом и ждёт, пока он закроет базу"""
+    process = multiprocessing.get_context("spawn").Process(target=compact_indexes, name="bot-compaction")
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        print(f"Удаление устаревших событий не удалось (код {process.exitcode})")
+
+
+def wait_for_worker(url, timeout, ready=True):
+    """Ждёт, пока воркер начнёт принимать запросы (ready=True — и загрузит агента)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + "/health", timeout=5):
+                return True
+        except urllib.error.HTTPError as e:
+            if e.code == 500:
+                return False  # агент не загрузился
+            if not ready:
+                return True  # 503: воркер работает, но агент ещё загружается
+        except OSError:
+            pass
+        time.sleep(1)
+    return False
+
+
+def start_workers(count):
+    """
+    Запускает воркеры-процессы. Первый воркер при необходимости выгружает индекс mmap,
+    остальные запускаются после него и открывают базу и индексы только для чтения
+    """
+    context = multiprocessing.get_context("spawn")
+    metrics_port = int(os.getenv("METRICS_PORT", "0"))
+    processes, urls = [], []
+    for i in range(count):
+        port = WORKER_BASE_PORT + i
+        process = context.Process(
+            target=run_worker,
+            args=(port, metrics_port + 1 + i if metrics_port else 0),
+            name=f"bot-worker-{i}",
+            daemon=True
+        )
+        process.start()
+        processes.append(process)
+        urls.append(f"http://127.0.0.1:{port}")
+        if not wait_for_worker(urls[-1], WORKER_START_TIMEOUT, ready=(i == 0)):
+            for started in processes:
+                started.terminate()
+            sys.exit(f"Воркер {i} не запустился")
+        print(f"Воркер {i} запущен на порту {port}")
+    return processes, urls
+
+
+def make_app(worker_urls):
+    """Балансировщик: проверяет секрет Telegram и пересылает обновление воркеру пользователя"""
+    session = None
+
+    async def on_startup(app):
+        nonlocal session
+        session = ClientSession(timeout=ClientTimeout(total=30))
+
+    async def on_cleanup(app):
+        await session.close()
+
+    async def handle_update(request):
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            user_id = update_user_id(json.loads(body))
+        except ValueError:
+            return web.Response(status=400)
+        url = worker_urls[worker_for(user_id, len(worker_urls))]
+        headers = {"Content-Type": "application/json"}
+        if WEBHOOK_SECRET:
+            # Воркер тоже проверяет секрет: обновления в обход балансировщика не принимаются
+            headers["X-Telegram-Bot-Api-Secret-Token"] = WEBHOOK_SECRET
+        try:
+            async with session.post(url + WEBHOOK_PATH, data=body, headers=headers) as response:
+                # Воркер обрабатывает обновление в фоне и отвечает сразу; при ошибке
+                # Telegram повторит доставку
+                return web.Response(status=response.status)
+        except (ClientError, asyncio.TimeoutError) as e:
+            print(f"Воркер {url} недоступен: {e}")
+            return web.Response(status=503)
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+async def register_webhook():
+    if not WEBHOOK_URL:
+        print("WEBHOOK_URL не задан — webhook в Telegram не регистрируется")
+        return
+    async with Bot(token=TG_TOKEN) as tg_bot:
+        await tg_bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None)
+    print(f"Webhook зарегистрирован: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бот в режиме webhook с несколькими воркерами")
+    parser.add_argument("--workers", type=int, default=WEBHOOK_WORKERS, help="число процессов-воркеров")
+    parser.add_argument("--worker", action="store_true",
+                        help="запустить только воркер (для отдельного контейнера за балансировщиком)")
+    parser.add_argument("--compact", action="store_true",
+                        help="только обновить базу и удалить закончившиеся события (перед запуском воркеров)")
+    parser.add_argument("--port", type=int, default=None, help="порт балансировщика или воркера")
+    parser.add_argument("--host", default=None, help="адрес воркера в режиме --worker (по умолчанию WORKER_HOST)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.compact:
+        compact_indexes()
+        return
+
+    if args.worker:
+        import bot
+        asyncio.run(bot.serve_webhook(args.host or WORKER_HOST, args.port or WORKER_BASE_PORT,
+                                      int(os.getenv("METRICS_PORT", "0"))))
+        return
+
+    processes = []
+    worker_urls = WEBHOOK_WORKER_URLS
+    if not worker_urls:
+        run_compaction()
+        processes, worker_urls = start_workers(args.workers)
+
+    asyncio.run(register_webhook())
+    print(f"Балансировщик: :{args.port or WEBHOOK_PORT}{WEBHOOK_PATH} -> {len(worker_urls)} воркеров")
+    try:
+        web.run_app(make_app(worker_urls), host=WEBHOOK_HOST, port=args.port or WEBHOOK_PORT, print=None)
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()